@@ -4,74 +4,160 @@ EditPy is a lightweight, text-based text editor.
 © 2023 Antithesise
 """
 
-from platform import system
-
 try:
-    from isansitty import isansitty # type: ignore
+    from isansitty import isansitty, issynchronised # type: ignore
 except ImportError:
     from sys import stdout
 
     isansitty = stdout.isatty
 
-if system() != "Windows":
-    raise EnvironmentError("EditPy cannot run on this Operating System.")
+    def issynchronised() -> bool: return False
 
 if not isansitty():
     raise EnvironmentError("EditPy must be run in a TTY.")
 
-from os import get_terminal_size, remove, startfile
-from os.path import abspath, basename
+from os import O_RDONLY, close, fstat, fsync, get_terminal_size, name, remove, replace
+from os import open as openfd
+from os.path import abspath, basename, dirname, getsize
 from pyperclip import copy, paste
-from re import match, split, sub
-from msvcrt import getch, kbhit
-from time import sleep
+from re import error, finditer, match, sub
+from shutil import copymode
+from tempfile import mkstemp
+from threading import Thread
+from time import monotonic, sleep
 
-from typing import Literal, Optional, Self, Type, overload
+from typing import Iterator, Literal, Optional, Self, Type, Union, overload
 from types import TracebackType
 
+from buffer import Buffer
+from history import History
+from journal import Journal
+from pager import Pager
+from search import Index, pattern, search
+from terminal import Terminal
+
 try:
-    from highlight import Highlight, escapeansi, indexansi, insertansi # type: ignore
+    from os import startfile # type: ignore
+except ImportError:
+    from subprocess import run
+
+    def startfile(path: str, operation: str) -> None: run(["lp", path], capture_output=True)
 
-    highlight = Highlight().__call__
+class Plain:
+    def __init__(self, extension: str="", lexer: str="") -> None: pass
+    def edit(self, y: int, removed: int, added: int) -> None: pass
+    def busy(self) -> bool: return False
+    def lines(self, text: Union[Buffer, Pager], start: int, stop: int) -> list[tuple[str, list[tuple[str, int, int]]]]: return [(l, []) for l in text[text.linestart(start):text.lineend(stop - 1)].split("\n")]
+
+try:
+    from highlight import Colours, Highlighter, Lexers # type: ignore
 except ImportError:
-    def highlight(extension: str, text: str) -> str: return text
-    def escapeansi(text: str) -> str: return text
-    def indexansi(text: str, start: int, stop: Optional[int]=None, step: Optional[int]=1) -> str: return text[start:(stop or len(text)):(step or 1)]
-    def insertansi(text: list[str], pos: int, t: str, a: Optional[bool]=False) -> list[str]: text.insert(pos, t); return text
+    Colours: dict[str, str] = {}
+    Highlighter = Plain # type: ignore
+    Lexers: dict[str, dict] = {}
 
 
 class EditPy:
-    def __init__(self, file: Optional[str]=None) -> None:
+    fps = 60 # most frames drawn a second
+    chunk = 1 << 20 # characters of a file read between frames
+    viewable = 1 << 26 # bytes from which a file opens read-only in the pager
+    undoable = 1 << 24 # rough bytes of undo history kept
+    queries = 8 # most searches whose matches are kept indexed
+    cached = 1024 # most painted rows kept for reuse
+    lexer = "patterns" # how files are lexed when opened, patterns or tokens
+
+    def __init__(self, file: Optional[str]=None, view: Optional[bool]=None) -> None:
         self.mode = 0 # 0: edit mode and 1: command mode
 
-        self.restore_help() # restores help file
-        self.open(file)
+        self.terminal = Terminal() # keyboard
 
-        if file is None:
-            self.text = "Press ctrl+/ to open EditPy help.\n" # contents
-            self.ci = 34 # caret index
+        self.restore_help() # restores help file
+        self.resize()
 
         self.footer = "" # footer
         self.fi = 0 # footer caret index
         self.fs = 0 # footer selection size
 
+        self.text: Union[Buffer, Pager] = Buffer()
+        self.loading: Optional[Iterator[float]] = None
+        self.journal: Optional[Journal] = None
+        self.indexes: dict[str, Index] = {}
+        self.saving: Optional[Thread] = None # writes the last save
+        self.stored = 1.0 # fraction of the last save written
+        self.failed = "" # why the last save failed
+        self.cache: dict[tuple, str] = {} # painted rows by what they depend on, least recent first
+        self.hits = 0 # rows taken from the cache
+        self.misses = 0 # rows painted
+        self.open(file, view)
+
+        if file is None:
+            self.edit(0, 0, "Press ctrl+/ to open EditPy help.\n", False)
+            self.ci = 34 # caret index
+
+        self.frame: list[Optional[str]] = [] # rows last painted, None if overwritten
+        self.overlay = "" # overlay last painted over them
+        self.synchronised = False # terminal supports synchronised updates
+        self.written = 0 # bytes written by the last frame
+        self.painted = 0.0 # when the last frame was written
+
+        self.notice = "" # shown in the status until the next key
+
     def restore_help(self) -> None:
         try:
             with open("help", "x", encoding="utf-8") as f:
-                f.write("Welcome to EditPy.\n\n\nGeneric:\n           esc: enter/exit command mode\n    left/right: move caret left/right\n     ctrl+left: increase selection to left\n    ctrl+right: increase selection to right\n\nEdit Mode:\n         enter: new line\n           tab: insert four spaces\n       up/down: move caret up/down\n     char keys: input character\n\nCommand Mode:\n         enter: input command\n       up/down: scroll up/down\n             a: select all\n    h[<t>]/<r>: replace regex <r> with forward-slash-less text <t>\n        m[<n>]: scroll <n> lines\n     n[<path>]: create and open new file, with optional path\n     o[<path>]: open <path> or empty file\n             p: print current file\n             q: quit editor\n     s[<path>]: save or save to <path>\n             w: close file\n             ?: opens help\n      =[index]: moves caret to <index>\n\nShortcuts:\n        ctrl+a: select all\n        ctrl+c: copy text\n        ctrl+q: quit editor\n        ctrl+n: create file\n        ctrl+o: open file\n        ctrl+s: save file\n        ctrl+v: paste text\n        ctrl+w: close file\n        ctrl+/: open help\n\nDialogs:\n           esc: cancel action\n         enter: confirm input\n    arrow keys: move caret/select option\n")
+                f.write("Welcome to EditPy.\n\n\nGeneric:\n           esc: enter/exit command mode\n    left/right: move caret left/right\n     ctrl+left: increase selection to left\n    ctrl+right: increase selection to right\n\nEdit Mode:\n         enter: new line\n           tab: insert four spaces\n       up/down: move caret up/down\n     char keys: input character\n\nCommand Mode:\n         enter: input command\n       up/down: scroll up/down\n             a: select all\n        b[<r>]: select previous match of regex <r>, or of the last search\n        f[<r>]: select next match of regex <r>, or of the last search\n    h[<t>]/<r>: replace regex <r> with forward-slash-less text <t>, in the selection if any\n      l<lexer>: lex the file with <lexer>, patterns or tokens\n        m[<n>]: scroll <n> lines\n     n[<path>]: create and open new file, with optional path\n     o[<path>]: open <path> or empty file\n             p: print current file\n             q: quit editor\n    r[<t>]/<r>: replace the next match of regex <r> with <t>\n     s[<path>]: save or save to <path>\n             u: undo\n       v<path>: view <path> read-only\n             w: close file\n             y: redo\n             ?: opens help\n      =[index]: moves caret to <index>\n\nShortcuts:\n        ctrl+a: select all\n        ctrl+c: copy text\n        ctrl+q: quit editor\n        ctrl+n: create file\n        ctrl+o: open file\n        ctrl+s: save file\n        ctrl+v: paste text\n        ctrl+w: close file\n        ctrl+y: redo\n        ctrl+z: undo\n        ctrl+/: open help\n\nDialogs:\n           esc: cancel action\n         enter: confirm input\n    arrow keys: move caret/select option\n")
 
         except FileExistsError:
             pass
 
-    def open(self, path: Optional[str]=None) -> None:
+    def open(self, path: Optional[str]=None, view: Optional[bool]=None) -> None:
+        """
+        Opens path, in the read-only pager if view, or by default if it is big.
+        """
+
+        if self.loading is not None:
+            self.loading.close()
+
+        if isinstance(self.text, Pager):
+            self.text.close()
+
+        if self.saving is not None: # the last save lands before its journal is closed
+            self.saving.join()
+
+        if self.journal is not None: # closed on purpose, so nothing needs recovering unless the last save failed
+            self.journal.close(bool(self.failed))
+
+        self.failed = ""
+
+        for index in self.indexes.values():
+            index.cancel()
+
         self.file = path # filepath
-        self.text = "" # contents
+        self.text = Buffer() # contents
+        self.newline = "\n" # line ending of the file, standardised to \n in text
+        self.loading = None # rest of the file while it streams in, or of the pager's line index
+        self.loaded = 1.0 # fraction of the file read
+        self.readonly = False # file is shown in the pager
+        self.journal = None # edits since the last save, kept for recovery
+        self.history = History(self.undoable) # undo and redo
+        self.indexes = {} # matches of recent searches, least recent first
+        self.query = "" # search whose matches are highlighted
+        self.lexing = self.lexer # how the file is lexed
 
         if self.file is not None:
             self.file = abspath(self.file.rstrip("/"))
+            self.readonly = getsize(self.file) >= self.viewable if view is None else view
+
+            if self.readonly:
+                self.text = Pager(self.file)
+                self.loading = self.text.index()
+                self.mode = 1 # commands only
+            else:
+                self.loading = self.load(self.file)
+
+        self.highlighter = (Plain if self.readonly else Highlighter)(self.getfilename().rsplit(".", 1)[-1], self.lexing) # syntax highlighter
 
-            with open(self.file, "r", encoding="utf-8") as f:
-                self.text = sub(r"\r\n|\r|\n", "\n", f.read()) # standardise line ending
+        self.step() # first screen, the rest streams in between frames
 
         self.ci = 0 # caret index
         self.cx = 0 # caret x
@@ -80,12 +166,237 @@ class EditPy:
 
         self.sx = 0 # scroll x
         self.sy = 0 # scroll y
+        self.follow = False # caret moved since the view last followed it
 
         self.saved = True # file is saved
 
+        if self.file is not None and not self.readonly:
+            journal = Journal(self.file)
+            edits = journal.restore() # left by a crash
+
+            if edits:
+                self.finish()
+
+                for start, stop, text in edits:
+                    self.edit(start, stop, text)
+
+                self.saved = False
+
+            self.journal = journal
+
         self.calculate()
 
+    def load(self, path: str) -> Iterator[float]:
+        """
+        Streams path into the buffer, yielding the fraction read after each chunk.
+        """
+
+        with open(path, "r", encoding="utf-8") as f: # universal newlines standardise line endings as they are decoded
+            size = max(1, fstat(f.fileno()).st_size)
+
+            while chunk := f.read(self.chunk):
+                self.highlighter.edit(self.text.lines - 1, 0, chunk.count("\n"))
+                self.text.insert(len(self.text), chunk) # type: ignore
+
+                for index in self.indexes.values():
+                    index.edit(len(self.text) - len(chunk), len(self.text) - len(chunk), len(chunk))
+
+                yield f.buffer.tell() / size
+
+            if isinstance(f.newlines, str): # a single line ending was seen
+                self.newline = f.newlines
+
+    def step(self) -> None:
+        """
+        Reads the next chunk of a file still streaming in, or indexes it.
+        """
+
+        if self.loading is not None:
+            try:
+                self.loaded = next(self.loading)
+            except StopIteration:
+                self.loading = None
+                self.loaded = 1.0
+
+    def finish(self) -> None:
+        while self.loading is not None:
+            self.step()
+
+    def edit(self, start: int, stop: int, text: str="", undoable: bool=True) -> None:
+        self.splice([(start, stop, text)], undoable)
+
+    def splice(self, spans: list[tuple[int, int, str]], undoable: bool=True) -> None:
+        """
+        Replaces each (start, stop) span with its text, in order and not
+        overlapping, rebuilding the rope once. Each is still undone and
+        journaled as its own edit, last first.
+        """
+
+        if not spans:
+            return
+
+        a, b = spans[0][0], spans[-1][1]
+        old = self.text[a:b] if undoable or len(spans) > 1 else ""
+        parts = []
+        x = a
+
+        for start, stop, text in spans:
+            parts += [old[x - a:start - a], text]
+            x = stop
+
+        for start, stop, text in reversed(spans):
+            if undoable:
+                self.history.record(start, old[start - a:stop - a], text)
+
+                if self.history.dropped:
+                    self.notice = "too big to undo"
+
+            if self.journal is not None:
+                self.journal.record(start, stop, text)
+
+        new = "".join(parts)
+        y = self.text.line(a)
+
+        self.highlighter.edit(y, self.text.line(b) - y, new.count("\n"))
+        self.text.replace(a, b, new) # type: ignore
+
+        for index in self.indexes.values():
+            if len(spans) == 1:
+                index.edit(a, b, len(new))
+            else: # cheaper to search again
+                index.start()
+
+    def undo(self, redo: bool=False) -> None:
+        step = self.history.redo() if redo else self.history.undo()
+
+        if step is None:
+            return
+
+        if all(d[0] >= e[0] + len(e[1]) for d, e in zip(step, step[1:])): # a splice, last first
+            shift = 0
+            spans = []
+
+            for start, removed, inserted in reversed(step):
+                if redo:
+                    spans.append((start, start + len(removed), inserted))
+                else:
+                    spans.append((start + shift, start + shift + len(inserted), removed))
+                    shift += len(inserted) - len(removed)
+
+            self.splice(spans, False)
+
+        else:
+            for start, removed, inserted in (step if redo else reversed(step)):
+                if redo:
+                    self.edit(start, start + len(removed), inserted, False)
+                else:
+                    self.edit(start, start + len(inserted), removed, False)
+
+        start, removed, inserted = step[0]
+
+        self.ci = start + len(inserted if redo else removed)
+        self.cs = 0
+
+        self.follow = True
+        self.saved = False
+
+    def index(self, regex: str) -> Optional[Index]:
+        """
+        Returns the match index of regex, or None if it is not valid.
+        """
+
+        try:
+            p = pattern(regex)
+        except error:
+            return None
+
+        index = self.indexes.pop(regex, None)
+
+        if index is None:
+            for r in [r for r, i in self.indexes.items() if not i.done and r != self.query]: # queries typed past
+                self.indexes.pop(r).cancel()
+
+            index = Index(self.text, p)
+
+        self.indexes[regex] = index # now the most recent
+
+        if len(self.indexes) > self.queries:
+            self.indexes.pop(next(iter(self.indexes))).cancel()
+
+        return index
+
+    def find(self, regex: str, backwards: bool=False) -> None:
+        """
+        Selects the next match of regex after the caret, or the previous.
+        """
+
+        index = self.index(regex)
+
+        if index is None:
+            self.notice = "bad regex"
+
+            return
+
+        found = index.previous(self.ci) if backwards else index.next(self.ci)
+
+        if found is None:
+            self.notice = "no matches"
+        else:
+            self.ci = found[0]
+            self.cs = max(0, found[1] - found[0] - 1)
+
+            if index.done:
+                self.notice = f"{len(index)} matches"
+
+        self.query = regex
+        self.follow = True
+
+    def replace(self, regex: str, template: str, once: bool=False) -> None:
+        """
+        Replaces the matches of regex with template, within the selection if
+        there is one, or only the next after the caret if once.
+        """
+
+        try:
+            p = pattern(regex)
+        except error as e:
+            self.notice = f"bad regex: {e}"
+
+            return
+
+        self.finish()
+
+        a, b = (self.ci, self.ci + self.cs + 1) if self.cs else (0, len(self.text))
+
+        if once:
+            found = next(search(self.text, p, self.ci), None) or next(search(self.text, p), None) # wraps round
+            matches = [found] if found else []
+        else:
+            matches = list(search(self.text, p, a, b))
+
+        try:
+            spans = [(s, e, m.expand(template) if "\\" in template else template) for s, e, m in matches]
+        except error as e:
+            self.notice = f"bad replacement: {e}"
+
+            return
+
+        self.splice(spans)
+
+        if once and spans:
+            self.ci = spans[0][0] + len(spans[0][2])
+            self.cs = 0
+        elif self.cs:
+            self.cs = max(0, b - a - 1 + sum(len(t) - (e - s) for s, e, t in spans))
+
+        self.notice = f"{len(spans)} replaced"
+        self.saved = self.saved and not spans
+        self.follow = True
+
     def save(self, path: Optional[str]=None) -> None:
+        if self.readonly:
+            return
+
         if self.file is None:
             o = (path or self.dialog("save"))
 
@@ -93,12 +404,74 @@ class EditPy:
                 return
 
             self.file = abspath(o.rstrip("/"))
+            self.highlighter = Highlighter(self.getfilename().rsplit(".", 1)[-1], self.lexing)
+
+        self.finish()
+
+        if self.saving is not None: # saves land in order
+            self.saving.join()
+
+        open(self.file, "a").close() # so a new file gets the usual permissions
 
-        with open(self.file, "w", encoding="utf-8") as f:
-            f.write(self.text)
+        if self.journal is None:
+            self.journal = Journal(self.file)
 
+        self.saving = Thread(target=self.store, args=(self.file, self.text.copy(), self.newline, self.journal, self.journal.mark()), daemon=True)
+        self.stored = 0.0
+        self.failed = ""
         self.saved = True
 
+        self.saving.start()
+
+    def store(self, path: str, text: Buffer, newline: str, journal: Journal, mark: int) -> None:
+        """
+        Writes text to a temporary file beside path, then renames it over
+        path, so path holds either the old or the new text, never a part.
+        The journal then keeps only the edits made since mark.
+        """
+
+        tmp = ""
+
+        try:
+            fd, tmp = mkstemp(prefix=f".{basename(path)}.", suffix=".tmp", dir=dirname(path))
+
+            with open(fd, "w", encoding="utf-8", newline=newline) as f:
+                done = 0
+
+                for chunk in text.chunks():
+                    f.write(chunk)
+
+                    done += len(chunk)
+                    self.stored = done / max(1, len(text))
+
+                f.flush()
+                fsync(f.fileno())
+
+            copymode(path, tmp)
+            replace(tmp, path)
+
+            if name != "nt": # make the rename itself durable
+                d = openfd(dirname(path), O_RDONLY)
+
+                try:
+                    fsync(d)
+                finally:
+                    close(d)
+
+            journal.rebase(mark)
+
+        except OSError as e:
+            try:
+                if tmp:
+                    remove(tmp)
+            except OSError:
+                pass
+
+            self.failed = e.strerror or str(e)
+            self.saved = False
+
+        self.stored = 1.0
+
     def print(self) -> None:
         tmp = None
 
@@ -108,8 +481,10 @@ class EditPy:
         except FileNotFoundError:
             pass
 
+        self.finish()
+
         with open("tmp.txt", "w", encoding="utf-8") as t:
-            t.write(self.text)
+            t.writelines(self.text.chunks())
 
         startfile(abspath("tmp.txt"), "print")
 
@@ -128,7 +503,7 @@ class EditPy:
             return basename(self.file)
 
     def reset(self) -> None:
-        print(end="\x1b[2J\x1b[H\x1b[?25h\x1b[?47l")
+        print(end="\x1b[2J\x1b[H\x1b[?25h\x1b[?2004l\x1b[?47l")
 
     def ellipse(self, text: str, size: int, rtrunc: bool=True) -> str:
         if size < 4:
@@ -146,48 +521,121 @@ class EditPy:
     def calculate(self, t: Literal[False]=...) -> None: pass
 
     def calculate(self, t=True):
-        self.size = get_terminal_size()
+        self.lines = self.text.lines
+        self.padding = len(str(self.lines))
 
-        text = [l + " " for l in split(r"\n", highlight(self.getfilename().rsplit(".", 1)[-1], self.text))]
+        self.cx, self.cy = self.text.position(self.ci)
 
-        self.lines = len(text)
-        self.padding = len(str(self.lines))
+        if not t:
+            return
 
-        line = []
+        width = self.size.columns - self.padding - 1
 
-        i = self.ci
-        for y, l in enumerate(text):
-            if t:
-                line = list(indexansi(l, self.sx, self.sx + self.size.columns - self.padding - 1))
+        text = []
 
-            for x in range(len(escapeansi(l)) * (i >= -self.cs - 2)):
-                i -= 1
+        query = self.footer[1:] if self.mode == 1 and self.footer[:1] in ["f", "b"] and len(self.footer) > 1 else self.query # highlighted as it is typed
+        index = self.index(query) if query else None
+        found = index.within(self.text.linestart(self.sy), self.text.lineend(self.sy + self.size.lines - self.mode - 2)) if index is not None else [] # visible matches
 
-                if i == -1:
-                    self.cx = x
-                    self.cy = y
+        for y, (l, spans) in enumerate(self.highlighter.lines(self.text, self.sy, self.sy + self.size.lines - self.mode - 1), self.sy):
+            ls, le = self.text.linestart(y), self.text.lineend(y)
+            column = lambda i: self.text.column(ls, i) # offsets on the line to columns, as a pager's are bytes
 
-                    if t:
-                        for j in range(min(len(line), x - self.sx + self.cs + 1), x - self.sx, -1):
-                            line = insertansi(line, j, "\x1b[7m", a=True)
+            a = column(min(max(self.ci, ls), le + 1)) # selected columns
+            b = column(min(self.ci + self.cs, le)) + 1 if self.ci + self.cs >= ls else 0
 
-                elif x == 0 and -self.cs - 2 < i < 0 and t:
-                    for j in range(min(len(line), self.cs + i - self.sx + 2), 0, -1):
-                        line = insertansi(line, j, "\x1b[7m", a=True)
+            marks = [(column(max(s, ls)), column(min(e, le + 1))) for s, e in found if s <= le and e > ls]
 
-                elif i == -self.cs - 2 and t:
-                    line = insertansi(line, min(len(line), x - self.sx + 1), "\x1b[27m", a=True)
+            a, b = max(a, self.sx), min(b, self.sx + width, len(l) + 1) # visible selected columns
+            a, b = (a, b) if a < b else (0, 0)
 
-            if t:
-                text[y] = f"\x1b[2m{str(y + 1).rjust(self.padding)}\x1b[22m {''.join(line)}\x1b[0m\n"
+            key = (l, tuple(spans), self.sx, width, a, b, tuple(marks))
+            row = self.cache.pop(key, None)
+
+            if row is None:
+                row = self.paint(l + " ", spans, self.sx, self.sx + width, a, b, marks)
+                self.misses += 1
+
+                if len(self.cache) >= self.cached:
+                    self.cache.pop(next(iter(self.cache)))
+            else:
+                self.hits += 1
 
-        if t:
-            return text[self.sy:self.sy + self.size.lines - self.mode - 1]
+            self.cache[key] = row # now the most recent
+
+            text.append(f"\x1b[2m{str(y + 1).rjust(self.padding)}\x1b[22m {row}\x1b[0m\n")
+
+        return text
+
+    def paint(self, text: str, spans: list[tuple[str, int, int]], start: int, stop: int, a: int, b: int, marks: list[tuple[int, int]]=[]) -> str:
+        """
+        Renders columns start to stop of a highlighted line, inverting columns
+        a to b and marking the columns of search matches. Escapes are only
+        written where the style changes, adding to the current one where it
+        can rather than resetting it.
+        """
+
+        stop = max(start, min(stop, len(text)))
+        cuts = sorted({start, stop} | {min(max(x, start), stop) for x in [a, b] + [x for _, s, e in spans for x in (s, e)] + [x for m in marks for x in m]})
+
+        res = []
+        state: list[str] = [] # escapes in effect
+        i = 0
+        j = 0
+
+        for s, e in zip(cuts, cuts[1:]):
+            while i < len(spans) and spans[i][2] <= s:
+                i += 1
+
+            while j < len(marks) and marks[j][1] <= s:
+                j += 1
+
+            sgr = [Colours[c] for c in spans[i][0].split()] if i < len(spans) and spans[i][1] <= s else []
+            sgr += ["\x1b[43m"] * (j < len(marks) and marks[j][0] <= s)
+            sgr += ["\x1b[7m"] * (a <= s < b)
+
+            if sgr[:len(state)] == state: # only adds to the style
+                res.append("".join(sgr[len(state):]))
+            else:
+                res.append("\x1b[0m" + "".join(sgr))
+
+            res.append(text[s:e])
+            state = sgr
+
+        return "".join(res) # the caller resets after
+
+    def clipboard(self, code: int | str) -> str:
+        """
+        Returns the text of a bracketed paste, or else of the clipboard.
+        """
+
+        return code if isinstance(code, str) else paste()
+
+    def busy(self) -> bool:
+        return self.saving is not None and self.saving.is_alive()
+
+    def resize(self) -> None:
+        self.size = get_terminal_size()
+        self.frame = [] # everything moved
+
+    def wait(self, timeout: Optional[float]=None) -> Optional[str]:
+        """
+        Waits for a key, keeping the terminal size up to date meanwhile.
+        """
+
+        event = self.terminal.wait(timeout)
+
+        if event == "resize":
+            self.resize()
+
+        return event
 
     def scroll(self) -> None:
+        self.follow = False
+
         self.calculate(False)
 
-        xthreshhold = min(self.cs, max(0, self.text.find("\n", self.ci) - self.ci)) - (self.size.columns - self.padding - 1)
+        xthreshhold = min(self.cs, self.text.lineend(self.cy) - self.ci) - (self.size.columns - self.padding - 1)
         ythreshhold = self.size.lines - self.mode - 2
 
         if self.sx > self.cx - 3:
@@ -202,27 +650,62 @@ class EditPy:
         elif self.sy < self.cy - ythreshhold:
             self.sy = max(0, self.cy - ythreshhold)
 
-    def redraw(self, flush: bool=True) -> None:
+    def redraw(self, overlay: str="") -> None:
+        """
+        Repaints the rows that changed since the last frame, then overlay.
+        """
+
+        if self.follow:
+            self.scroll()
+
         text = self.calculate()
 
         header = f"{self.cx},{self.cy} ({self.cs + 1})"
-        self.status = f"EditPy - {'(unsaved) ' * (not self.saved)}{self.getfilename()}"
+        self.status = f"EditPy - {'(unsaved) ' * (not self.saved)}{'(read-only) ' * self.readonly}{f'(loading {self.loaded:.0%}) ' * (self.loading is not None)}{f'(saving {self.stored:.0%}) ' * self.busy()}{f'(save failed: {self.failed}) ' * bool(self.failed)}{f'({self.notice}) ' * bool(self.notice)}{self.getfilename()}"
 
-        print(
-            "\x1b[2J\x1b[H" + header[:self.size.columns] + (" " * max(2, self.size.columns - len(header + self.status))) + self.ellipse(self.status, self.size.columns - len(header) - 2),
-            "".join(text).removesuffix("\n"),
-            sep="\n",
-            end="\n" * (self.size.lines - self.lines - self.mode - 1),
-            flush=False
-        )
+        rows = [header[:self.size.columns] + (" " * max(2, self.size.columns - len(header + self.status))) + self.ellipse(self.status, self.size.columns - len(header) - 2)]
+        rows += [l.removesuffix("\n") for l in text]
+        rows += [""] * (self.size.lines - len(rows) - self.mode)
 
         if self.mode == 1:
             footer = self.ellipse(self.footer + " ", self.size.columns - self.padding - 1)
             footer = footer[:self.fi] + "\x1b[7m" + footer[self.fi:self.fi + self.fs + 1] + "\x1b[27m" + footer[self.fi + self.fs + 1:]
 
-            print(end=f"\n{' ' * (self.padding - 1)}:{footer}\x1b[0m", flush=False)
+            rows.append(f"{' ' * (self.padding - 1)}:{footer}\x1b[0m")
 
-        print(end="", flush=flush)
+        out = []
+
+        if not self.frame:
+            out.append("\x1b[2J")
+
+        covered = {int(m.group(1)) - 1 for m in finditer(r"\x1b\[([0-9]+);[0-9]+H", self.overlay)} # rows under the last overlay
+
+        if not overlay:
+            self.frame = [None if y in covered else row for y, row in enumerate(self.frame)]
+
+        for y, row in enumerate(rows):
+            if y >= len(self.frame) or self.frame[y] != row:
+                out.append(f"\x1b[{y + 1};1H\x1b[K{row}")
+
+                if y in covered:
+                    self.overlay = "" # painted over, so paint it again
+
+        if overlay != self.overlay:
+            out.append(overlay)
+
+        self.frame = rows # type: ignore
+        self.overlay = overlay
+
+        frame = "".join(out)
+
+        if self.synchronised:
+            frame = f"\x1b[?2026h{frame}\x1b[?2026l"
+
+        self.written = len(frame.encode())
+
+        print(end=frame, flush=True)
+
+        self.painted = monotonic()
 
     @overload
     def dialog(self, func: Literal["save"]=...) -> str | None: pass
@@ -244,23 +727,19 @@ class EditPy:
         ds = 0 # dialog selection size
         dv = ".txt" # dialog value
 
-        code = 0
-
         while True:
             try:
-                self.redraw(False)
-
                 if func in ["save", "open"]:
                     t = self.ellipse(dv, 11, False).ljust(12)
                     f = di - min(0, 11 - len(dv))
 
-                    print(end=msgs[func].format(
+                    self.redraw(msgs[func].format(
                         x=round((self.size.columns - 20) / 2),
                         n=t[:f] + "\x1b[7m" + t[f:f + ds + 1] + "\x1b[27m" + t[f + ds + 1:]
-                    ), flush=True)
+                    ))
 
                 elif func == "close":
-                    print(end=msgs["close"].format(
+                    self.redraw(msgs["close"].format(
                         x=round((self.size.columns - 20) / 2),
                         ty=("┌───┐" if di else "▗▄▄▄▖"),
                         tn=("▗▄▄▄▖" if di else "┌───┐"),
@@ -268,13 +747,12 @@ class EditPy:
                         mn=("▐█\x1b[38;5;234m\x1b[48;5;251mN\x1b[0m█▌" if di else "│ N │"),
                         by=("└───┘" if di else "▝▀▀▀▘"),
                         bn=("▝▀▀▀▘" if di else "└───┘")
-                    ), flush=True)
+                    ))
 
-                key = ord(getch())
+                if self.wait() != "key": # resized
+                    continue
 
-                if key in [0, 224]:
-                    key = 0
-                    code = ord(getch())
+                key, code = self.terminal.getkey()
             except KeyboardInterrupt:
                 key = 3
 
@@ -335,7 +813,7 @@ class EditPy:
 
                 elif key == 22: # ctrl+v, sometimes?
                     if func in ["save", "open"]:
-                        dv = dv[:di] + sub(r"\r\n|\r|\n", "", paste()) + dv[di + ds + 1:]
+                        dv = dv[:di] + sub(r"\r\n|\r|\n", "", self.clipboard(code)) + dv[di + ds + 1:]
 
                         ds = 0
 
@@ -356,11 +834,18 @@ class EditPy:
             self.ci = 0
             self.cs = len(self.text) - 1
 
-        elif cmd == "h" and args:
+        elif cmd in ["f", "b"] and (args or self.query):
+            self.find(args or self.query, cmd == "b")
+
+        elif cmd in ["h", "r"] and args and not self.readonly:
             s = args.rfind("/")
 
             if s != -1:
-                self.text = sub(args[s + 1:], args[:s], self.text)
+                self.replace(args[s + 1:], args[:s], cmd == "r")
+
+        elif cmd == "l" and args in Lexers and not self.readonly:
+            self.lexing = args
+            self.highlighter = Highlighter(self.getfilename().rsplit(".", 1)[-1], self.lexing)
 
         elif cmd == "m" and args:
             if match(r"[+-]?[1-9][0-9]*", args):
@@ -400,6 +885,20 @@ class EditPy:
         elif cmd == "s":
             self.save(args)
 
+        elif cmd == "v":
+            if not self.saved:
+                if self.dialog("close") in [False, None]:
+                    return ""
+
+            if args.rstrip("/"):
+                self.open(args.rstrip("/"), True)
+
+        elif cmd == "u":
+            self.undo()
+
+        elif cmd == "y":
+            self.undo(True)
+
         elif cmd == "w":
             if not self.saved:
                 if self.dialog("close") in [False, None]:
@@ -408,6 +907,9 @@ class EditPy:
             self.open()
 
         elif cmd == "=" and args:
+            if not self.readonly: # the pager knows its length and seeks lines through its index
+                self.finish()
+
             try:
                 if 0 <= int(args) <= len(self.text):
                     self.ci = int(args)
@@ -416,6 +918,8 @@ class EditPy:
             except:
                 pass
 
+            self.follow = True
+
         elif cmd == "?":
             if not self.saved:
                 if self.dialog("close") in [False, None]:
@@ -426,39 +930,50 @@ class EditPy:
         return ""
 
     def __call__(self) -> None:
-        print(end="\x1b[?47h\x1b[?25l")
+        print(end="\x1b[?47h\x1b[?25l\x1b[?2004h") # bracketed paste on
 
-        code = 0
+        self.synchronised = issynchronised()
+        self.resize()
 
-        while True:
-            self.redraw()
+        start = monotonic() # when input for the next frame started
+        typed = False # last key typed a character
 
+        while True:
             try:
-                while not kbhit():
-                    pass
+                if self.wait(max(0, self.painted + 1 / self.fps - monotonic())) != "key" or monotonic() >= start + 1 / self.fps: # input has settled or a frame is due
+                    self.redraw()
+
+                    while self.wait(0 if self.loading is not None else 1 / self.fps if self.highlighter.busy() else 0.1 if self.busy() else None) != "key": # resized, or still loading, highlighting or saving
+                        self.step()
+                        self.redraw()
 
-                key = ord(getch())
+                    start = monotonic()
 
-                if key in [0, 224]:
-                    key = 0
-                    code = ord(getch())
+                key, code = self.terminal.getkey()
             except KeyboardInterrupt:
                 key = 3
 
-            if self.mode == 0:
-                if key == 0:
-                    if code == 72: # up
-                        if "\n" in self.text[:self.ci]:
-                            self.ci = self.text.rindex("\n", 0, self.ci)
+            self.notice = ""
 
-                            if "\n" in self.text[:self.ci]:
-                                self.ci = self.text.rindex("\n", 0, self.ci) + 1
+            if not (typing := self.mode == 0 and key >= 32) or not typed: # only typing joins typing in one undo step
+                self.history.seal()
 
-                            else:
-                                self.ci = 0
+            typed = typing
 
-                        else:
-                            self.ci = 0
+            if key == 25: # ctrl+y
+                self.undo(True)
+
+                continue
+
+            if key == 26: # ctrl+z
+                self.undo()
+
+                continue
+
+            if self.mode == 0:
+                if key == 0:
+                    if code == 72: # up
+                        self.ci = self.text.linestart(self.text.line(self.ci) - 1)
 
                     elif code == 75 and self.ci + self.cs > 0: # left
                         if self.ci > 0:
@@ -471,14 +986,10 @@ class EditPy:
                         self.cs = 0
 
                     elif code == 80: # down
-                        if "\n" in self.text[self.ci:]:
-                            self.ci = self.text.index("\n", self.ci) + 1
-
-                        else:
-                            self.ci = len(self.text)
+                        self.ci = self.text.linestart(self.text.line(self.ci) + 1)
 
                     elif code == 83 and self.ci < len(self.text): # delete
-                        self.text = self.text[:self.ci] + self.text[self.ci + self.cs + 1:]
+                        self.edit(self.ci, self.ci + self.cs + 1)
 
                         self.cs = 0
 
@@ -491,7 +1002,7 @@ class EditPy:
                     elif code == 116 and self.ci + self.cs < len(self.text) - 1: # ctrl+right
                         self.cs += 1
 
-                    self.scroll()
+                    self.follow = True
 
                     if code in [83]:
                         self.saved = False
@@ -510,12 +1021,12 @@ class EditPy:
                             if self.ci > 0:
                                 self.ci -= (self.cs == 0)
 
-                            self.text = self.text[:self.ci] + self.text[self.ci + self.cs + 1:]
+                            self.edit(self.ci, self.ci + self.cs + 1)
 
                             self.cs = 0
 
                     elif key == 9: # tab:
-                        self.text = self.text[:self.ci] + "    " + self.text[self.ci + self.cs + (self.cs != 0):]
+                        self.edit(self.ci, self.ci + self.cs + (self.cs != 0), "    ")
 
                         self.ci += 4
                         self.cs = 0
@@ -523,7 +1034,7 @@ class EditPy:
                         self.saved = False
 
                     elif key in [10, 13]: # newline / carriage return
-                        self.text = self.text[:self.ci] + "\n" + self.text[self.ci + self.cs + (self.cs != 0):]
+                        self.edit(self.ci, self.ci + self.cs + (self.cs != 0), "\n")
 
                         self.ci += 1
                         self.cs = 0
@@ -565,8 +1076,11 @@ class EditPy:
                         self.save()
 
                     elif key == 22: # ctrl+v, sometimes?
-                        self.text = self.text[:self.ci] + sub(r"\r\n|\r|\n", "\n", paste()) + self.text[self.ci + self.cs + 1:]
+                        t = sub(r"\r\n|\r", "\n", self.clipboard(code))
 
+                        self.edit(self.ci, self.ci + self.cs + (self.cs != 0), t)
+
+                        self.ci += len(t)
                         self.cs = 0
 
                     elif key == 23: # ctrl+w:
@@ -590,7 +1104,7 @@ class EditPy:
                         pass
 
                     else: # any other key
-                        self.text = self.text[:self.ci] + chr(key) + self.text[self.ci + self.cs + (self.cs != 0):]
+                        self.edit(self.ci, self.ci + self.cs + (self.cs != 0), chr(key))
 
                         self.ci += 1
                         self.cs = 0
@@ -598,13 +1112,16 @@ class EditPy:
                         self.saved = False
 
                     if key != 27:
-                        self.scroll()
+                        self.follow = True
 
                     if key in [8, 9, 10, 13, 22]:
                         self.saved = False
 
                 continue
 
+            if self.follow: # before scrolling by hand
+                self.scroll()
+
             if key == 0:
                 if code == 72: # up
                     if self.sy > 0:
@@ -704,9 +1221,9 @@ class EditPy:
                     self.save()
 
                 elif key == 22: # ctrl+v, sometimes?
-                    self.text = self.footer[:self.fi] + sub(r"\r\n|\r|\n", "\n", paste()) + self.footer[self.fi + self.fs + 1:]
+                    self.footer = self.footer[:self.fi] + sub(r"\r\n|\r|\n", "", self.clipboard(code)) + self.footer[self.fi + self.fs + 1:]
 
-                    self.cs = 0
+                    self.fs = 0
 
                 elif key == 23: # ctrl+w:
                     if not self.saved:
@@ -716,7 +1233,8 @@ class EditPy:
                     self.open()
 
                 elif key == 27: # escape:
-                    self.mode = 0
+                    self.mode = int(self.readonly) # the pager has no edit mode
+                    self.query = ""
 
                 elif key == 31: # ctrl+/
                     if not self.saved:
@@ -735,10 +1253,19 @@ class EditPy:
                     self.fs = 0
 
     def __enter__(self) -> Self:
+        self.terminal.start()
+
         return self
 
     def __exit__(self, __type: Type[BaseException] | None, __value: BaseException | None, __traceback: TracebackType | None, /) -> None:
+        if self.saving is not None: # finish writing before exiting
+            self.saving.join()
+
+        if self.journal is not None: # kept if exiting on an error, or if the last save failed
+            self.journal.close(__type is not None or bool(self.failed))
+
         self.reset()
+        self.terminal.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,337 @@
+"""
+This is EditPy's Text Buffer.
+
+© 2023 Antithesise
+"""
+
+from random import random
+
+from typing import Iterator, Optional, overload
+
+
+CHUNK = 1024 # largest chunk of text kept in one node
+
+
+class Node:
+    """
+    An immutable rope node, ordered as a treap on priority.
+    """
+
+    __slots__ = ("text", "priority", "left", "right", "nl", "size", "breaks")
+
+    def __init__(self, text: str, priority: float, left: Optional["Node"]=None, right: Optional["Node"]=None, nl: Optional[int]=None) -> None:
+        self.text = text
+        self.priority = priority
+        self.left = left
+        self.right = right
+
+        self.nl = text.count("\n") if nl is None else nl # line breaks in text
+
+        self.size = len(text) + size(left) + size(right)
+        self.breaks = self.nl + breaks(left) + breaks(right) # line breaks in subtree
+
+def size(node: Optional[Node]) -> int:
+    return node.size if node else 0
+
+def breaks(node: Optional[Node]) -> int:
+    return node.breaks if node else 0
+
+def build(text: str, depth: float=0) -> Optional[Node]:
+    chunks = [text[i:i + CHUNK] for i in range(0, len(text), CHUNK)]
+
+    def tree(lo: int, hi: int, d: float) -> Optional[Node]:
+        if lo >= hi:
+            return None
+
+        mid = (lo + hi) // 2
+
+        return Node(chunks[mid], d + random(), tree(lo, mid, d - 1), tree(mid + 1, hi, d - 1))
+
+    return tree(0, len(chunks), depth + len(chunks).bit_length())
+
+def split(node: Optional[Node], i: int) -> tuple[Optional[Node], Optional[Node]]:
+    if node is None:
+        return None, None
+
+    ls = size(node.left)
+
+    if i <= ls:
+        a, b = split(node.left, i)
+
+        return a, Node(node.text, node.priority, b, node.right, node.nl)
+
+    if i >= ls + len(node.text):
+        a, b = split(node.right, i - ls - len(node.text))
+
+        return Node(node.text, node.priority, node.left, a, node.nl), b
+
+    return Node(node.text[:i - ls], node.priority, node.left), Node(node.text[i - ls:], node.priority, None, node.right)
+
+def merge(a: Optional[Node], b: Optional[Node]) -> Optional[Node]:
+    if a is None:
+        return b
+
+    if b is None:
+        return a
+
+    if a.priority > b.priority:
+        return Node(a.text, a.priority, a.left, merge(a.right, b), a.nl)
+
+    return Node(b.text, b.priority, merge(a, b.left), b.right, b.nl)
+
+def patch(node: Optional[Node], start: int, stop: int, text: str) -> Optional[tuple[Node, str, int]]:
+    """
+    Replaces a range lying within a single node in place, or returns None.
+    Text overflowing the node is returned with the offset it belongs at.
+    """
+
+    if node is None:
+        return None
+
+    ls = size(node.left)
+    end = ls + len(node.text)
+
+    if ls <= start and stop <= end:
+        new = node.text[:start - ls] + text + node.text[stop - ls:]
+        half = len(new) // 2 if len(new) > CHUNK else len(new)
+
+        if new:
+            return Node(new[:half], node.priority, node.left, node.right), new[half:], ls + half
+
+    elif stop <= ls:
+        res = patch(node.left, start, stop, text)
+
+        if res is not None:
+            return Node(node.text, node.priority, res[0], node.right, node.nl), res[1], res[2]
+
+    elif start >= end:
+        res = patch(node.right, start - end, stop - end, text)
+
+        if res is not None:
+            return Node(node.text, node.priority, node.left, res[0], node.nl), res[1], res[2] + end
+
+    return None
+
+
+class Buffer:
+    """
+    A persistent rope, so copies are free and edits are O(log n).
+    """
+
+    def __init__(self, text: str="") -> None:
+        self.root = build(text)
+
+    def __len__(self) -> int:
+        return size(self.root)
+
+    def __str__(self) -> str:
+        return "".join(self.chunks())
+
+    def __repr__(self) -> str:
+        return f"Buffer({len(self)} chars)"
+
+    @overload
+    def __getitem__(self, key: int) -> str: pass
+
+    @overload
+    def __getitem__(self, key: slice) -> str: pass
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+
+            if step != 1:
+                return str(self)[key]
+
+            return "".join(self.chunks(start, stop))
+
+        if key < 0:
+            key += len(self)
+
+        if not 0 <= key < len(self):
+            raise IndexError("buffer index out of range")
+
+        return "".join(self.chunks(key, key + 1))
+
+    @property
+    def lines(self) -> int:
+        return breaks(self.root) + 1
+
+    def line(self, i: int) -> int:
+        """
+        Returns the line containing offset i.
+        """
+
+        node = self.root
+        y = 0
+
+        while node is not None:
+            ls = size(node.left)
+
+            if i <= ls:
+                node = node.left
+
+            elif i <= ls + len(node.text):
+                return y + breaks(node.left) + node.text.count("\n", 0, i - ls)
+
+            else:
+                y += breaks(node.left) + node.nl
+                i -= ls + len(node.text)
+                node = node.right
+
+        return y
+
+    def linestart(self, y: int) -> int:
+        """
+        Returns the offset of the first character of line y.
+        """
+
+        if y <= 0:
+            return 0
+
+        if y >= self.lines:
+            return len(self)
+
+        node = self.root
+        offset = 0
+
+        while node is not None:
+            lb = breaks(node.left)
+
+            if y <= lb:
+                node = node.left
+
+            elif y <= lb + node.nl:
+                rest = node.text.split("\n", y - lb)[-1]
+
+                return offset + size(node.left) + len(node.text) - len(rest)
+
+            else:
+                y -= lb + node.nl
+                offset += size(node.left) + len(node.text)
+                node = node.right
+
+        return offset
+
+    def lineend(self, y: int) -> int:
+        """
+        Returns the offset of the line break ending line y.
+        """
+
+        return self.linestart(y + 1) - (y + 1 < self.lines)
+
+    def position(self, i: int) -> tuple[int, int]:
+        y = self.line(i)
+
+        return self.column(self.linestart(y), i), y
+
+    def column(self, start: int, i: int) -> int:
+        """
+        Returns the column of offset i on the line starting at offset start.
+        """
+
+        return i - start
+
+    def copy(self) -> "Buffer":
+        new = Buffer()
+        new.root = self.root
+
+        return new
+
+    def chunks(self, start: int=0, stop: Optional[int]=None) -> Iterator[str]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(0, start)
+
+        stack = []
+        node = self.root
+        offset = 0 # offset of node's subtree
+
+        while stack or node is not None:
+            while node is not None:
+                if start >= offset + size(node.left) + len(node.text): # only the right subtree is wanted
+                    offset += size(node.left) + len(node.text)
+                    node = node.right
+
+                    continue
+
+                stack.append((node, offset))
+                node = node.left
+
+            if not stack:
+                break
+
+            node, offset = stack.pop()
+            a = offset + size(node.left) # absolute start of node.text
+
+            if a >= stop:
+                break
+
+            if a + len(node.text) > start:
+                yield node.text[max(0, start - a):stop - a]
+
+            offset = a + len(node.text)
+            node = node.right
+
+    def replace(self, start: int, stop: int, text: str="") -> None:
+        start = max(0, min(start, len(self)))
+        stop = max(start, min(stop, len(self)))
+
+        if start == stop and not text:
+            return
+
+        res = patch(self.root, start, stop, text) if len(text) <= CHUNK else None
+
+        if res is None:
+            a, b = split(self.root, stop)
+            a, _ = split(a, start)
+
+            self.root = merge(merge(a, build(text, -1)), b)
+
+        else:
+            self.root, spill, at = res
+
+            if spill: # falls on a node boundary, so nothing is cut
+                a, b = split(self.root, at)
+
+                self.root = merge(merge(a, Node(spill, random())), b)
+
+    def insert(self, i: int, text: str) -> None:
+        self.replace(i, i, text)
+
+    def delete(self, start: int, stop: int) -> None:
+        self.replace(start, stop)
+
+    def find(self, sub: str, start: int=0, end: Optional[int]=None) -> int:
+        end = len(self) if end is None else min(end, len(self))
+        carry = ""
+        offset = max(0, start)
+
+        for chunk in self.chunks(offset, end):
+            text = carry + chunk
+            i = text.find(sub)
+
+            if i != -1:
+                return offset - len(carry) + i
+
+            offset += len(chunk)
+            carry = text[-len(sub) + 1:] if len(sub) > 1 else ""
+
+        return -1
+
+    def rfind(self, sub: str, start: int=0, end: Optional[int]=None) -> int:
+        end = len(self) if end is None else min(end, len(self))
+        start = max(0, start)
+
+        while end > start:
+            lo = max(start, end - CHUNK - len(sub))
+            i = self[lo:end].rfind(sub)
+
+            if i != -1:
+                return lo + i
+
+            if lo == start:
+                break
+
+            end = lo + len(sub) - 1
+
+        return -1
@@ -4,9 +4,23 @@ This is EditPy's Syntax Highlighting Engine.
 © 2023 Antithesise
 """
 
-from re import match, search, sub
+import builtins
 
-from typing import Optional
+from io import StringIO
+from keyword import kwlist
+from math import inf
+from re import MULTILINE, Pattern, compile, escape, finditer, match, sub
+from threading import Lock, Thread, local
+from time import monotonic
+from token import COMMENT, DEDENT, ENDMARKER, ERRORTOKEN, INDENT, NAME, NEWLINE, NL, NUMBER, OP, STRING, tok_name
+from tokenize import TokenError, generate_tokens
+
+from typing import Callable, Iterator, Optional, Union
+
+
+Piece = tuple[Optional[str], str] # style and text
+Span = tuple[str, int, int] # style and columns styled
+Line = tuple[str, list[Span]] # text and spans
 
 
 Colours = {
@@ -39,6 +53,7 @@ Colours = {
     "subtag": "\x1b[38;2;%d;%d;%dm" % (140, 220, 254),
     "tag": "\x1b[38;2;%d;%d;%dm" % (128, 128, 128),
     "tagname": "\x1b[38;2;%d;%d;%dm" % (86, 156, 214),
+    "url": "\x1b[4m",
     "value1": "\x1b[38;2;%d;%d;%dm" % (206, 145, 120),
     "value2": "\x1b[38;2;%d;%d;%dm" % (220, 220, 170)
 }
@@ -52,23 +67,21 @@ class Patterns:
     CSS = [
         (r"/\*(?:[^\*]|\*(?!/))*\*/", "comment"),
         (r"\*", "asterisk"),
-        (r"(?s)(?:(?!\W)[^\[\'\"]|#|::|:|@)?(?:\w|\-)+(?:\((?=.*\)))?(?![^\[]*=|[^\'\"\[]*[\'\"])(?=[^;]*\{)", "selector"),
+        (r"(?s)(?:(?!\W)[^\[\'\"]|#|::|:|@)?(?:\w|\-)+(?:\((?=.*\)))?(?![^\[\]\{\};]*\])(?=[^;\{\}]*\{)", "selector"),
         (r"(?:\w|\-)+(?=[\s]*[:=])", "attribute"),
         (r"\"[^\n\"]*\"|\'[^\n\']*\'", "string"),
         (r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:cm|mm|in|px|pt|pc|em|ex|ch|rem|vw|vh|vmin|vmax|\%)?", "number"),
-        (r"[^:(), ]+(?= *\([^:]*;)", "value2"),
-        (r"[^:(), ]+(?=[^:]*;)", "value1"),
+        (r"[^:(), ;]+(?= *\()(?=[^:;]*;)", "value2"),
+        (r"[^:(), ;]+(?=[^:;]*;)", "value1"),
         (r".", "plain")
     ]
     HTML = [
         (r"<--.*-->", "comment"),
         (r"</|<!|<\?|<|/>|\?>|>", "tag"),
-        (r"(?a)[^ \"\n=<>]+(?=.*[/]?>)(?!=|<|[^> ]|[^>]*<)|\&(?:#x|#)?[a-zA-z0-9]{2,};", "tagname"),
-        (r"(?s)(?:.(?!<script))*(?=</script>)", "js"),
-        (r"(?s)(?:.(?!<style))*(?=</style>)", "css"),
+        (r"(?a)[^ \"\n=<>]++(?![^> ])(?=[^<>\n]*>)|\&(?:#x|#)?[a-zA-z0-9]{2,};", "tagname"),
         (r"\"[^\n\"]*\"|\'[^\n\']*\'", "string"),
         (r"(?a)[^ \"\n=<>]+(?==)", "subtag"),
-        (r".", "plain")
+        (r"[^<>\n&\"\'=]++(?=[<\n]|\Z)|[^ \"\'\n=<>&]+|.", "plain") # text no other pattern can match within, at once
     ]
     JSON = [
         (r"\btrue\b|\bfalse\b|\bnull\b", "keyword"),
@@ -80,21 +93,21 @@ class Patterns:
     MARKDOWN = [
         (r"^(?:\*\*\*|\-\-\-|\_\_\_) *$", "plain"),
         (r"\\[`!#*()-_+{}\[\]\\.]", "escape"),
-        (r"(?P<del>\*\*|__)([^\*_].*)?(?!\\)(?P=del)", "bold"),
-        (r"(?<!_)(?P<del>[\*_])([^\*_].*)?(?!\\)(?P=del)", "italic"),
-        (r"(?P<tilde>\~{2,}).*(?!\\)(?P=tilde)", "strikethrough"),
+        (r"(?P<del>\*\*|__)([^\*_].*?)?(?!\\)(?P=del)", "bold"),
+        (r"(?<!_)(?P<del>[\*_])([^\*_].*?)?(?!\\)(?P=del)", "italic"),
+        (r"(?P<tilde>\~{2,}).*?(?!\\)(?P=tilde)", "strikethrough"),
         (r"^(?: *>)+", "block"),
         (r"\#{1,6}(?: +[^\#\n]*)?", "heading"),
         (r"^ *[0-9]+\.|^ *[\-\*\+] ", "list"),
-        (r"(?P<multitick>\`{3,})[^\`]*(?!\\)(?P=multitick)|(?P<tick>\`{1,2})[^\`\n]*(?!\\)(?P=tick)|[^\[\n\]]+(?!\\)(?=\])", "string"),
-        (r".", "plain")
+        (r"(?P<multitick>\`{3,})[^\`]*(?!\\)(?P=multitick)|(?P<tick>\`{1,2})[^\`\n]*(?!\\)(?P=tick)|(?<=\[)[^\[\n\]]++(?!\\)(?=\])", "string"),
+        (r"[^\W_]+| +|.", "plain") # letters and spaces at once, as no pattern starts within them
     ]
     PYTHON = [
         (r"\#[^\n]*", "comment"),
         (r"(?s)(?:r[bf]?|[bf]?r)\"\"\"(?:[^\\]|\\.)*\"\"\"|(?:r[bf]?|[bf]?r)\'\'\'(?:[^\\]|\\.)*\'\'\'|(?:r[bf]?|[bf]?r)\"(?:[^\"\\\n]|\\.)*\"|(?:r[bf]?|[bf]?r)\'(?:[^\'\\\n]|\\.)*\'", "regex"),
         (r"\bdef\b|\bpass\b|\blambda\b|\bglobal\b|\bnonlocal\b|\bTrue\b|\bFalse\b|\bNone\b|\bb(?=[\"\'])|\bf(?=[\"\'])|\bu(?=[\"\'])|\\ *\n", "keyword1"),
         (r"\bwhile\b|\bfor\b|\bif\b|\belif\b|\belse\b|\bcontinue\b|\bbreak\b|\btry\b|\bexcept\b|\bfinally\b|\bassert\b|\braise\b|\bfrom\b|\bwith\b|\bas\b|\bawait\b|\basync\b|\breturn\b|\byield\b|\bdel\b|\band\b|\bor\b|\bnot\b|\bin\b|\bis\b", "keyword2"),
-        (r"(?a)(?:import|class) +(?:[a-zA-Z_]\w*(?: *\. *)?)+|(?:[a-zA-Z_]\w*(?: *\. *)?)+ +import|\bbool\b|\bint\b|\bfloat\b|\bcomplex\b|\blist\b|\btuple\b|\brange\b|\bstr\b|\bbytes\b|\bbytearray\b|\bmemoryview\b|\bset\b|\bfrozenset\b|\bdict\b|\bobject\b|\bfunction\b|\btype\b|\bArithmeticError\b|\bAssertionError\b|\bAttributeError\b|\bBaseException\b|\bBlockingIOError\b|\bBrokenPipeError\b|\bBufferError\b|\bBytesWarning\b|\bConnectionAbortedError\b|\bChildProcessError\b|\bConnectionError\b|\bConnectionRefusedError\b|\bConnectionResetError\b|\bDeprecationWarning\b|\bEncodingWarning\b|\bEOFError\b|\bException\b|\bFileExistsError\b|\bFileNotFoundError\b|\bFloatingPointError\b|\bFutureWarning\b|\bGeneratorExit\b|\bImportError\b|\bImportWarning\b|\bIndentationError\b|\bIndexError\b|\bInterruptedError\b|\bIsADirectoryError\b|\bKeyboardInterrupt\b|\bKeyError\b|\bLookupError\b|\bMemoryError\b|\bModuleNotFoundError\b|\bNameError\b|\bNotADirectoryError\b|\bNotImplementedError\b|\bOverflowError\b|\bPendingDeprecationWarning\b|\bPermissionError\b|\bProcessLookupError\b|\bRecursionError\b|\bReferenceError\b|\bResourceWarning\b|\bRuntimeError\b|\bRuntimeWarning\b|\bStopAsyncIteration\b|\bStopIteration\b|\bSyntaxError\b|\bSyntaxWarning\b|\bSystemError\b|\bSystemExit\b|\bTabError\b|\bTimeoutError\b|\bTypeError\b|\bUnboundLocalError\b|\bUnicodeDecodeError\b|\bUnicodeEncodeError\b|\bUnicodeError\b|\bUnicodeTranslateError\b|\bUnicodeWarning\b|\bUserWarning\b|\bValueError\b|\bWarning\b|\bZeroDivisionError\b", "class"),
+        (r"(?a)(?:import|class) +[a-zA-Z_]\w*(?: *\. *[a-zA-Z_]\w*)*(?: *\. *)?|[a-zA-Z_]\w*(?: *\. *[a-zA-Z_]\w*)*(?: *\. *)? +import|\bbool\b|\bint\b|\bfloat\b|\bcomplex\b|\blist\b|\btuple\b|\brange\b|\bstr\b|\bbytes\b|\bbytearray\b|\bmemoryview\b|\bset\b|\bfrozenset\b|\bdict\b|\bobject\b|\bfunction\b|\btype\b|\bArithmeticError\b|\bAssertionError\b|\bAttributeError\b|\bBaseException\b|\bBlockingIOError\b|\bBrokenPipeError\b|\bBufferError\b|\bBytesWarning\b|\bConnectionAbortedError\b|\bChildProcessError\b|\bConnectionError\b|\bConnectionRefusedError\b|\bConnectionResetError\b|\bDeprecationWarning\b|\bEncodingWarning\b|\bEOFError\b|\bException\b|\bFileExistsError\b|\bFileNotFoundError\b|\bFloatingPointError\b|\bFutureWarning\b|\bGeneratorExit\b|\bImportError\b|\bImportWarning\b|\bIndentationError\b|\bIndexError\b|\bInterruptedError\b|\bIsADirectoryError\b|\bKeyboardInterrupt\b|\bKeyError\b|\bLookupError\b|\bMemoryError\b|\bModuleNotFoundError\b|\bNameError\b|\bNotADirectoryError\b|\bNotImplementedError\b|\bOverflowError\b|\bPendingDeprecationWarning\b|\bPermissionError\b|\bProcessLookupError\b|\bRecursionError\b|\bReferenceError\b|\bResourceWarning\b|\bRuntimeError\b|\bRuntimeWarning\b|\bStopAsyncIteration\b|\bStopIteration\b|\bSyntaxError\b|\bSyntaxWarning\b|\bSystemError\b|\bSystemExit\b|\bTabError\b|\bTimeoutError\b|\bTypeError\b|\bUnboundLocalError\b|\bUnicodeDecodeError\b|\bUnicodeEncodeError\b|\bUnicodeError\b|\bUnicodeTranslateError\b|\bUnicodeWarning\b|\bUserWarning\b|\bValueError\b|\bWarning\b|\bZeroDivisionError\b", "class"),
         (r"(?a)\@[a-zA-Z_]\w*(?:\(.*\))?(?=\n(\s)*def )", "decorator"),
         (r"(?as)\b[a-zA-Z_]\w*(?= *\()", "function"),
         (r"(?a)\b[A-Z_][A-Z0-9_]*\b", "constant"),
@@ -103,291 +116,714 @@ class Patterns:
         (r"\"\"\"(?:(?!\"\"\")[^\\]|\\[0-9bfnortux\\\"\'\n])*\"\"\"|\'\'\'(?:(?!\'\'\')[^\\]|\\[0-9bfnortux\\\"\'\n])*\'\'\'|\"(?:[^\"\\\n]|\\[0-9bfnortux\\\"\'\n])*\"|\'(?:[^\'\\\n]|\\[0-9bfnortux\\\"\'\n])*\'", "string"),
         (r".", "plain")
     ]
-    URL = (
-        r"\b(?<![@.,%&#-])(?P<protocol>\w{2,10}\:\/\/)(?:(?:\w|\&\#\d{1,5};)[.-]?)+(?:\.(?:[a-z]{2,15})|(?(protocol)(?:\:\d{1,6})|(?!)))\b(?![@])(?:\/)?(?:(?:[\w\d\?\-=#:%@&.;])+(?:\/(?:(?:[\w\d\?\-=#:%@&;.])+))*)?(?<![.,?!-])",
-        lambda m: f"\x1b[4m{m.group(0)}\x1b[24m"
-    )
+    TEXT = [
+        (r"[^\n]+", "plain")
+    ]
+    EMBEDDED = { # openers and closers of text in another language, found by a scan rather than a pattern
+        "html": [(r"<script[^<>]*>", "</script>", "js"), (r"<style[^<>]*>", "</style>", "css")]
+    }
+    AHEADS = { # lookaheads settled by which of some delimiters comes next, with those delimiters
+        "css": [(r"(?=.*\))", r"\)"), (r"(?![^\[\]\{\};]*\])", r"[\[\]\{\};]"), (r"(?=[^;\{\}]*\{)", r"[;\{\}]"), (r"(?=[^:;]*;)", r"[:;]")],
+        "html": [(r"(?=[^<>\n]*>)", r"[<>\n]")]
+    }
+    REGIONS = { # delimiters of tokens that can span many lines
+        "css": [("/*", "*/")],
+        "html": [("<script", "</script>"), ("<style", "</style>")],
+        "md": [("```", "```")],
+        "py": [("\"\"\"", "\"\"\""), ("'''", "'''")],
+        "svg": [("<script", "</script>"), ("<style", "</style>")],
+        "xml": [("<script", "</script>"), ("<style", "</style>")]
+    }
+    URL = r"\b(?<![@.,%&#-])(?P<protocol>\w{2,10}\:\/\/)(?:(?:\w|\&\#\d{1,5};)[.-]?)+(?:\.(?:[a-z]{2,15})|(?(protocol)(?:\:\d{1,6})|(?!)))\b(?![@])(?:\/)?(?:(?:[\w\d\?\-=#:%@&.;])+(?:\/(?:(?:[\w\d\?\-=#:%@&;.])+))*)?(?<![.,?!-])"
+
+class Scanner:
+    """
+    A language's patterns compiled into one alternation, tried in order.
+    Embedded regions are cut out first, each taken whole as one token.
 
-class Highlight:
-    def __call__(self, extension: str, text: str) -> str:
-        return self.__getattribute__(extension.lower() if extension.lower() in "css html json md py svg txt xml".split() else "txt")(text)
+    A lookahead in aheads scans on to the next of its delimiters, so tried
+    at every token it would make scanning quadratic. Instead the next
+    delimiter is found once per stretch, and the alternation used is the
+    one with each lookahead replaced by whether it holds there.
+    """
 
-    def css(self, text: str) -> str:
-        text = sub(r"(?m)^\n(?=\n*(?P<level>(?:    )+))", lambda m: m.group("level") + "\n", text.replace("\t", "    ")) + "\n"
-        tokens = []
+    def __init__(self, patterns: list[tuple[str, str]], flags: int=0, embedded: list[tuple[str, str, str]]=[], aheads: list[tuple[str, str]]=[]) -> None:
+        self.styles: dict[str, Optional[str]] = {"n": None} # style of each alternative
+        alternatives = []
 
-        while len(text):
-            for p, v in Patterns.CSS:
-                m = match(p, text)
+        self.flags = flags
+        self.aheads = [(a, compile(a, flags).match, compile(d, flags).search) for a, d in aheads]
+        self.variants: dict[tuple[bool, ...], Pattern] = {} # alternation for each way the lookaheads can go
 
-                if m is not None:
-                    tokens.append((v, m.group(0)))
-                    text = text[m.end(0):]
+        self.closers = {f"e{i}": (c, v) for i, (_, c, v) in enumerate(embedded)} # closer and style of each opener
+        self.opener: Optional[Pattern] = compile("|".join(f"(?P<e{i}>{o})" for i, (o, _, _) in enumerate(embedded))) if embedded else None
 
-                    break
-            else:
-                tokens.append((None, "\n"))
-                text = text[1:]
+        for i, (p, v) in enumerate(patterns):
+            m = match(r"\(\?([aiLmsux]+)\)", p) # global flags become scoped flags
 
-        for t, v in tokens:
-            if t:
-                if v == " ":
-                    text += v
-                elif t == "selector":
-                    text += Colours["selector"] + v.replace("\n", "\n" + Colours["selector"]).replace("(", "\x1b[0m(" + Colours["selector"]) + "\x1b[0m"
-                elif t == "string":
-                    text += Colours["string"] + sub(r"\\(?![<>])\S", lambda m: Colours["escape"] + m.group(0) + Colours["string"], v).replace("\n", "\n" + Colours["string"]) + "\x1b[0m"
+            if m:
+                p = f"(?{m.group(1)}:{p[m.end(0):]})"
+
+            p = sub(r"\(\?P<(\w+)>", rf"(?P<\1_{i}>", p)
+            p = sub(r"\(\?P=(\w+)\)", rf"(?P=\1_{i})", p)
+            p = sub(r"\(\?\((\w+)\)", rf"(?(\1_{i})", p)
+
+            alternatives.append(f"(?P<t{i}>{p})")
+            self.styles[f"t{i}"] = v
+
+        self.source = "|".join(alternatives) + "|(?P<n>\n)"
+        self.pattern: Pattern = compile(self.source, flags)
+
+    def variant(self, holds: tuple[bool, ...]) -> Pattern:
+        if holds not in self.variants:
+            source = self.source
+
+            for (a, _, _), h in zip(self.aheads, holds):
+                source = source.replace(a, "" if h else "(?!)")
+
+            self.variants[holds] = compile(source, flags=self.flags)
+
+        return self.variants[holds]
+
+    def __call__(self, text: str, deadline: float=inf) -> list[tuple[Optional[str], str]]:
+        """
+        Returns the tokens of text, leaving the rest plain past deadline.
+        """
+
+        tokens: list[tuple[Optional[str], str]] = []
+        scan = self.pattern.match
+
+        for start, stop, style in self.regions(text):
+            if style is not None:
+                tokens.append((style, text[start:stop]))
+
+                continue
+
+            pos = start
+            nexts = [-1] * len(self.aheads) # next delimiter of each lookahead
+
+            while pos < stop:
+                if monotonic() > deadline:
+                    tokens.append(("plain", text[pos:]))
+
+                    return tokens
+
+                if any(n < pos for n in nexts): # passed a delimiter, so settle the lookaheads again
+                    for k, (_, _, find) in enumerate(self.aheads):
+                        if nexts[k] < pos:
+                            d = find(text, pos, stop)
+                            nexts[k] = d.start() if d else stop
+
+                    scan = self.variant(tuple(bool(test(text[n:n + 1] if n < stop else "")) for (_, test, _), n in zip(self.aheads, nexts))).match
+
+                m = scan(text, pos, stop)
+
+                if m is None or m.end() == pos: # nothing matched, or only an empty match
+                    tokens.append((None if text[pos] == "\n" else "plain", text[pos]))
+                    pos += 1
+
+                    continue
+
+                tokens.append((self.styles[m.lastgroup], m.group())) # type: ignore
+                pos = m.end()
+
+        return tokens
+
+    def regions(self, text: str) -> Iterator[tuple[int, int, Optional[str]]]:
+        """
+        Yields the spans of text to scan, and between them the embedded
+        regions, with their style.
+        """
+
+        pos = i = 0
+        unclosed = set() # closers not found again, so never looked for again
+
+        while self.opener is not None and (m := self.opener.search(text, i)):
+            closer, style = self.closers[m.lastgroup] # type: ignore
+            close = -1 if closer in unclosed else text.find(closer, m.end())
+            i = m.end()
+
+            if close == -1: # unclosed, so not embedded
+                unclosed.add(closer)
+
+                continue
+
+            yield pos, m.end(), None
+
+            if close > m.end():
+                yield m.end(), close, style
+
+            pos = i = close
+
+        yield pos, len(text), None
+
+class Tokenizer:
+    """
+    Python's own tokenizer, giving tokens of the styles the py patterns
+    give, so it can stand in for them. A window can start within a block,
+    so tokenizing starts again at any line dedenting past where it began,
+    and the rest of what it rejects is left to the patterns.
+    """
+
+    keywords1 = {"class", "def", "pass", "lambda", "global", "nonlocal", "True", "False", "None"}
+    keywords2 = set(kwlist) - keywords1
+    classes = {k for k, v in vars(builtins).items() if isinstance(v, type)} | {"function"}
+    constant = compile(r"[A-Z_][A-Z0-9_]*").fullmatch
+    gap = compile(r"(?P<continuation>\\ *\n)|\n|[^\\\n]+|\\") # between tokens, so spaces and line continuations
+
+    def __init__(self, fallback: Scanner) -> None:
+        self.fallback = fallback
+
+    def __call__(self, text: str, deadline: float=inf) -> list[tuple[Optional[str], str]]:
+        """
+        Returns the tokens of text, leaving the rest plain past deadline.
+        """
+
+        starts = [0] + [m.end() for m in finditer("\n", text)] # offset of each line
+        found: list[tuple[int, int, int]] = [] # type, start and stop of each token
+        stop = len(text) # end of what was tokenized
+        begin = 0 # line tokenizing last started at
+
+        while True:
+            try:
+                for t in generate_tokens(StringIO(text[starts[begin]:]).readline):
+                    if t.type in (INDENT, DEDENT, ENDMARKER) or t.start == t.end:
+                        continue
+
+                    found.append((t.type, starts[begin + t.start[0] - 1] + t.start[1], starts[begin + t.end[0] - 1] + t.end[1]))
+
+                    if monotonic() > deadline:
+                        stop = found[-1][2]
+
+                        return self.style(text, found, stop) + [("plain", text[stop:])]
+
+            except IndentationError as e: # dedented past where it began
+                if e.lineno is not None and e.lineno > 1:
+                    begin += e.lineno - 1
+
+                    continue
+
+                stop = found[-1][2] if found else 0
+
+            except (SyntaxError, TokenError): # an unclosed string or bracket, or a stray character
+                stop = found[-1][2] if found else 0
+
+            break
+
+        return self.style(text, found, stop) + self.fallback(text[stop:], deadline)
+
+    def style(self, text: str, found: list[tuple[int, int, int]], stop: int) -> list[tuple[Optional[str], str]]:
+        """
+        Returns the styled tokens of text up to stop, given the type and
+        span of each, with what lies between them.
+        """
+
+        tokens: list[tuple[Optional[str], str]] = []
+        x = 0 # end of the last token
+        dotted = False # names are of a class or module, after class, from or import
+        imports = True # an import names modules, unless after from
+        i = 0
+
+        while i < len(found):
+            t, a, b = found[i]
+            v = text[a:b]
+
+            tokens += self.spaces(text, x, a)
+            x = b
+            i += 1
+
+            if t == NAME and (v in self.keywords1 or v in self.keywords2):
+                tokens.append(("keyword1" if v in self.keywords1 else "keyword2", v))
+                dotted = v in ("class", "from") or v == "import" and imports
+                imports = imports and v != "from"
+
+                continue
+
+            if t == OP and v == "." and dotted:
+                tokens.append((None, v))
+
+                continue
+
+            named, dotted = dotted, False
+
+            if t == NAME:
+                n, c, _ = found[i] if i < len(found) else (None, b, b) # the token after
+
+                if named or v in self.classes:
+                    tokens.append(("class", v))
+                    dotted = named # as a dot may follow
+                elif n == OP and text[c] == "(" and not text[b:c].strip(" "):
+                    tokens.append(("function", v))
+                elif self.constant(v):
+                    tokens.append(("constant", v))
                 else:
-                    text += Colours[t] + v.replace("\n", "\n" + Colours[t]) + "\x1b[0m"
-            else:
-                text += "\n"
+                    tokens.append(("identifier", v))
 
-        while search(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", text):
-            text = sub(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", "\x1b[0m" + r"\1", text)
+            elif t == OP and v == "@" and not text[text.rfind("\n", 0, a) + 1:a].strip(" ") and i < len(found) and found[i][0] == NAME: # a decorator, with its dotted name
+                while i < len(found) and found[i][1] == x and (found[i][0] == NAME or text[found[i][1]] == "."):
+                    x = found[i][2]
+                    i += 1
 
-        text = sub(*Patterns.URL, text)
+                tokens.append(("decorator", text[a:x]))
 
-        return text.removesuffix("\n")
+            elif t == STRING or tok_name[t] == "FSTRING_START": # from 3.12 f-strings come in parts
+                k = len(v) - len(v.lstrip("bBfFrRuU")) # prefix
 
-    def html(self, text: str, lang: str="HTML") -> str:
-        text = sub(r"(?m)^\n(?=\n*(?P<level>(?:    )+))", lambda m: m.group("level") + "\n", text.replace("\t", "    ")) + "\n"
-        tokens = []
+                if t == STRING and "r" in v[:k].lower():
+                    tokens.append(("regex", v))
+                else:
+                    tokens += [("keyword1", v[:k])] * bool(k) + [("string", v[k:])]
 
-        while len(text):
-            for p, v in Patterns.HTML:
-                m = match(p, text)
+            elif tok_name[t] in ("FSTRING_MIDDLE", "FSTRING_END"):
+                tokens.append(("string", v))
 
-                if m is not None:
-                    tokens.append((v, m.group(0)))
-                    text = text[m.end(0):]
+            elif t in (NEWLINE, NL):
+                tokens.append((None, v))
+                imports = True
 
-                    break
+            elif t == COMMENT:
+                tokens.append(("comment", v))
+            elif t == NUMBER:
+                tokens.append(("number", v))
+            elif t == ERRORTOKEN:
+                tokens.append((None if v.isspace() else "plain", v))
             else:
-                tokens.append((None, "\n"))
-                text = text[1:]
+                tokens.append((None, v))
+
+        return tokens + self.spaces(text, x, stop)
+
+    def spaces(self, text: str, start: int, stop: int) -> list[tuple[Optional[str], str]]:
+        return [("keyword1" if m.lastgroup else None, m.group()) for m in self.gap.finditer(text, start, stop)]
+
+Scanners = {
+    "css": Scanner(Patterns.CSS, aheads=Patterns.AHEADS["css"]),
+    "html": Scanner(Patterns.HTML, embedded=Patterns.EMBEDDED["html"], aheads=Patterns.AHEADS["html"]),
+    "json": Scanner(Patterns.JSON),
+    "md": Scanner(Patterns.MARKDOWN, MULTILINE),
+    "py": Scanner(Patterns.PYTHON),
+    "txt": Scanner(Patterns.TEXT)
+}
+Scanners["svg"] = Scanners["xml"] = Scanners["html"]
+
+Lexers = { # lexers a buffer can be highlighted with, by name
+    "patterns": Scanners,
+    "tokens": {**Scanners, "py": Tokenizer(Scanners["py"])}
+}
+
+class Pass(local):
+    """
+    The pass lexing on this thread, kept apart from those on others, as a
+    highlighter's workers can overlap.
+    """
+
+    deadline = inf # when it runs out of time
+
+class Highlight:
+    budget = 0.1 # seconds a pass may take before the rest is left plain
+    scanners = Scanners # lexer of each language
+    current = Pass() # the pass on each thread
+
+    def __call__(self, extension: str, text: str) -> list[Line]:
+        self.current.deadline = monotonic() + self.budget
+
+        return self.split(self.render(self.language(extension), text))
+
+    def language(self, extension: str) -> str:
+        return extension.lower() if extension.lower() in "css html json md py svg txt xml".split() else "txt"
+
+    def tokenize(self, lang: str, text: str) -> list[Piece]:
+        return self.scanners[lang](sub(r"(?m)^\n(?=\n*(?P<level>(?:    )+))", lambda m: m.group("level") + "\n", text.replace("\t", "    ")) + "\n", self.current.deadline)
+
+    def render(self, lang: str, text: str, **options: bool) -> list[Piece]:
+        """
+        Returns the styled pieces of text, without the line break tokenize adds.
+        """
+
+        pieces = self.__getattribute__(lang)(self.tokenize(lang, text), **options)
+        t, v = pieces[-1]
+        pieces[-1] = (t, v.removesuffix("\n"))
+
+        return pieces
+
+    def split(self, pieces: list[Piece]) -> list[Line]:
+        """
+        Splits styled pieces into lines of text and the spans of columns styled.
+        """
+
+        lines: list[Line] = []
+        text: list[str] = []
+        spans: list[Span] = []
+        x = 0
+
+        for t, v in pieces:
+            for i, part in enumerate(v.split("\n")):
+                if i:
+                    lines.append(("".join(text), spans))
+                    text, spans, x = [], [], 0
+
+                if not part:
+                    continue
+
+                if t and t != "plain":
+                    if spans and spans[-1][0] == t and spans[-1][2] == x: # same style continues
+                        spans[-1] = (t, spans[-1][1], x + len(part))
+                    else:
+                        spans.append((t, x, x + len(part)))
+
+                text.append(part)
+                x += len(part)
+
+        lines.append(("".join(text), spans))
+
+        for l, spans in lines:
+            for m in finditer(Patterns.URL, l):
+                spans[:] = overlay(spans, m.start(), m.end(), "url")
+
+        return lines
+
+    def css(self, tokens: list[Piece]) -> list[Piece]:
+        pieces: list[Piece] = []
 
         for t, v in tokens:
-            if t:
-                if v == " ":
-                    text += v
-                elif t == "css":
-                    text += self.css(v)
-                else:
-                    text += Colours[t] + v.replace("\n", "\n" + Colours[t]) + "\x1b[0m"
+            if not t or v == " ":
+                pieces.append((None, v))
+            elif t == "selector":
+                pieces += mark(v, "selector", [(r"\(", None)])
+            elif t == "string":
+                pieces += mark(v, "string", [(r"\\(?![<>])\S", "escape")])
             else:
-                text += "\n"
+                pieces.append((t, v))
 
-        while search(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", text):
-            text = sub(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", "\x1b[0m" + r"\1", text)
+        return pieces
 
-        text = sub(*Patterns.URL, text)
+    def html(self, tokens: list[Piece]) -> list[Piece]:
+        pieces: list[Piece] = []
 
-        return text.removesuffix("\n")
+        for t, v in tokens:
+            if not t or v == " ":
+                pieces.append((None, v))
+            elif t == "css":
+                pieces += self.render("css", v)
+            else:
+                pieces.append((t, v))
 
-    def json(self, text: str) -> str:
-        text = sub(r"(?m)^\n(?=\n*(?P<level>(?:    )+))", lambda m: m.group("level") + "\n", text.replace("\t", "    ")) + "\n"
-        tokens = []
+        return pieces
 
-        while len(text):
-            for p, v in Patterns.JSON:
-                m = match(p, text)
+    def json(self, tokens: list[Piece]) -> list[Piece]:
+        return [(None if v == " " else t, v) for t, v in tokens]
 
-                if m is not None:
-                    tokens.append((v, m.group(0)))
-                    text = text[m.end(0):]
+    def md(self, tokens: list[Piece]) -> list[Piece]:
+        return [(None if v == " " else t, v) for t, v in tokens]
 
-                    break
-            else:
-                tokens.append((None, "\n"))
-                text = text[1:]
+    def py(self, tokens: list[Piece], fstrings: bool=True) -> list[Piece]:
+        pieces: list[Piece] = []
 
         for t, v in tokens:
-            if t:
-                if v == " ":
-                    text += v
+            if not t or t == "plain" or v == " ":
+                pieces.append((None, v))
+            elif t == "string":
+                if pieces[-1:] == [("keyword1", "f")] and fstrings:
+                    rules = [
+                        (r"\{[^\"\\\}]+\}" if v[0] == "\"" else r"\{[^\'\\\}]+\}", lambda s: self.render("py", s, fstrings=False)),
+                        (r"\\(?= *\n)", "keyword1")
+                    ]
                 else:
-                    text += Colours[t] + v.replace("\n", "\n" + Colours[t]) + "\x1b[0m"
+                    rules = [(r"\%[diouxXeEfFgGcrs\%]|\{[a-zA-Z_]\w*\}|\\(?= *\n)", "keyword1")]
+
+                pieces += mark(v, "string", rules + [(r"\\[ux][0-9a-f]+|\\[0-9]+|\\(?![<>])\S", "escape")])
+            elif t == "class" and v.endswith(" import"):
+                pieces += mark(v.removesuffix("import"), "class", [(r"\.", None)]) + [("keyword2", "import")]
+            elif t == "class" and v.startswith(("import ", "class ")):
+                k, v = v.split(" ", 1)
+                pieces += [("keyword2" if k == "import" else "keyword1", k + " ")] + mark(v, "class", [(r"\.", None)])
+            elif t == "decorator":
+                pieces += [("keyword1", v[0]), (t, v[1:])]
+            elif t == "regex":
+                k = len(v) - len(v.lstrip("bfr")) # string prefix
+
+                pieces += [("keyword1", v[:k])] + mark(v[k:], "regex", [
+                    (r"\[(?:\^)?|\]", "regex2"),
+                    (r"\\[\\~!@#$%\^&*()_+`1234567890-={}|\[\]:\";'?,./CEFGHIJKLMNOPQRTUVXYacefghijklmnopqrtuvxyz]|[*+]", "escape"),
+                    (r"\||\(\?(?:\(\w+\)|\<\=|\<\!|\=|\!)", None),
+                    (r"\?P\=\w+|\?P\<\w+\>|\(\?[aiLmsux]{1,7}(?:\-[imsx]{1,4})?\)", "keyword1")
+                ])
             else:
-                text += "\n"
+                pieces.append((t, v))
 
-        while search(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", text):
-            text = sub(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", "\x1b[0m" + r"\1", text)
+        return pieces
 
-        text = sub(*Patterns.URL, text)
+    def svg(self, tokens: list[Piece]) -> list[Piece]:
+        return self.html(tokens)
 
-        return text.removesuffix("\n")
+    def txt(self, tokens: list[Piece]) -> list[Piece]:
+        return tokens
 
-    def md(self, text: str) -> str:
-        text = sub(r"(?m)^\n(?=\n*(?P<level>(?:    )+))", lambda m: m.group("level") + "\n", text.replace("\t", "    ")) + "\n"
-        tokens = []
+    def xml(self, tokens: list[Piece]) -> list[Piece]:
+        return self.html(tokens)
 
-        while len(text):
-            for p, v in Patterns.MARKDOWN:
-                m = match(p, text)
+class Highlighter(Highlight):
+    """
+    Highlights a buffer line by line, remembering which lines start on a
+    token boundary so that only edited lines need to be lexed again. Lexing
+    runs on a worker thread, and until it is done, edited lines are painted
+    in the colours they last had, so a slow lexer never holds up a frame.
+    """
 
-                if m is not None:
-                    tokens.append((v, m.group(0)))
-                    text = text[m.end(0):]
+    lookback = 100 # lines lexed before a line with no known state
+    lookahead = 20 # lines lexed past the last line kept
 
-                    break
-            else:
-                tokens.append((None, "\n"))
-                text = text[1:]
+    def __init__(self, extension: str, lexer: str="patterns") -> None:
+        self.lang = self.language(extension)
+        self.scanners = Lexers[lexer]
 
-        for t, v in tokens:
-            if t:
-                if v == " ":
-                    text += v
+        self.rows: list[Optional[Line]] = [] # highlighted lines, None if dirty
+        self.clean: list[Optional[bool]] = [] # whether each line starts on a token boundary, None if unknown
+        self.stale: list[Optional[list[Span]]] = [] # spans each dirty line last had
+
+        self.generation = 0 # bumped by edits to cancel stale jobs
+        self.job: tuple[int, int, int] = (0, 0, -1) # lines and generation last sent to the worker
+        self.started = 0 # workers started, all but the last of which give up
+        self.worker: Optional[Thread] = None
+        self.lock = Lock() # guards the lists above
+
+    def edit(self, y: int, removed: int, added: int) -> None:
+        with self.lock:
+            self.generation += 1
+
+            if y < len(self.rows):
+                if self.rows[y] is not None:
+                    self.stale[y] = self.rows[y][1] # type: ignore
+
+                self.rows[y + 1:y + 1 + removed] = [None] * added
+                self.clean[y + 1:y + 1 + removed] = [None] * added
+                self.stale[y + 1:y + 1 + removed] = [None] * added
+
+                self.rows[y] = None
+
+    def grow(self, e: int) -> None:
+        if len(self.rows) < e:
+            self.rows += [None] * (e - len(self.rows))
+            self.clean += [None] * (e - len(self.clean))
+            self.stale += [None] * (e - len(self.stale))
+
+    def busy(self) -> bool:
+        return self.worker is not None and self.worker.is_alive()
+
+    def lex(self, text: str, retries: int) -> tuple[list[Line], list[bool], int]:
+        """
+        Returns the lines of text, whether each starts on a token boundary,
+        and how many were lexed before the budget, doubled for each retry,
+        ran out.
+        """
+
+        deadline = self.current.deadline = monotonic() + self.budget * 2 ** retries
+
+        tokens = self.tokenize(self.lang, text)
+        late = monotonic() > deadline # so the last token may be the plain rest
+        clean = [True]
+
+        for _, v in tokens:
+            n = v.count("\n")
+
+            if n:
+                clean += [False] * (n - 1) + [v.endswith("\n")]
+
+        rows = self.split(self.__getattribute__(self.lang)(tokens))[:-1] # the last follows the line break tokenize adds
+
+        if late:
+            done = sum(v.count("\n") for _, v in tokens[:-1])
+        elif monotonic() > deadline: # ran out within an embedded language, somewhere
+            done = 0
+        else:
+            done = len(rows)
+
+        return rows, clean[:len(rows)], done
+
+    def window(self, text, start: int, stop: int) -> str:
+        """
+        Returns lines start to stop, extended to close any region left open.
+        """
+
+        while True:
+            window = text[text.linestart(start):text.lineend(stop - 1)]
+            end = stop
+
+            for a, b in Patterns.REGIONS.get(self.lang, []):
+                if a == b:
+                    unclosed = window.count(a) % 2
                 else:
-                    text += Colours[t] + v.replace("\n", "\n" + Colours[t]) + "\x1b[0m"
-            else:
-                text += "\n"
+                    i = window.rfind(a)
+                    unclosed = i != -1 and window.find(b, i) == -1
 
-        while search(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", text):
-            text = sub(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", "\x1b[0m" + r"\1", text)
+                if unclosed:
+                    i = text.find(b, text.lineend(stop - 1))
 
-        text = sub(*Patterns.URL, text)
+                    if i != -1:
+                        end = max(end, text.line(i) + 1)
 
-        return text.removesuffix("\n")
+            if end == stop:
+                return window
 
-    def py(self, text: str, fstrings: bool=True) -> str:
-        text = sub(r"(?m)^\n(?=\n*(?P<level>(?:    )+))", lambda m: m.group("level") + "\n", text.replace("\t", "    ")) + "\n"
-        tokens = []
+            stop = end
 
-        while len(text):
-            for p, v in Patterns.PYTHON:
-                m = match(p, text)
+    def opening(self, text, r: int) -> int:
+        """
+        Returns the line opening the region line r starts within, or r if it
+        starts within none, pairing the delimiters from the top of text.
+        """
 
-                if m is not None:
-                    tokens.append((v, m.group(0)))
-                    text = text[m.end(0):]
+        regions = dict(Patterns.REGIONS.get(self.lang, []))
+        head = text[0:text.linestart(r)]
+        openers = compile("|".join(escape(a) for a in regions) or "(?!)")
+        i = 0
 
-                    break
-            else:
-                tokens.append((None, "\n"))
-                text = text[1:]
+        while (m := openers.search(head, i)) is not None:
+            i = head.find(regions[m.group()], m.end())
 
-        for t, v in tokens:
-            if t:
-                el = Colours[t] + f"{v}\x1b[0m"
-
-                if v == " ":
-                    el = " "
-                elif t == "string":
-                    if text.endswith(Colours["keyword1"] + "f\x1b[0m") and fstrings:
-                        el = sub((r"\{[^\"\\\}]+\}" if v[0] == "\"" else r"\{[^\'\\\}]+\}"), lambda m: self.py(m.group(0), fstrings=False), v)
-                        el = sub(r"\\(?= *\n)", lambda m: Colours["keyword1"] + "\\" + Colours["string"], el)
-                    else:
-                        el = sub(r"\%[diouxXeEfFgGcrs\%]|\{[a-zA-Z_]\w*\}|\\(?= *\n)", lambda m: Colours["keyword1"] + m.group(0) + Colours["string"], v)
-
-                    el = Colours["string"] + sub(r"\\[ux][0-9a-f]+|\\[0-9]+|\\(?![<>])\S", lambda m: Colours["escape"] + m.group(0) + Colours["string"], el) + "\x1b[0m"
-                elif t == "class" and el.endswith(" import\x1b[0m"):
-                    el = Colours["class"] + el.removesuffix("import\x1b[0m").replace(".", "\x1b[0m." + Colours["class"]) + Colours["keyword2"] + "import\x1b[0m"
-                elif t == "class" and el.startswith("import"):
-                    el = Colours["keyword2"] + "import " + Colours["class"] + el.split(" ", 1)[-1].replace(".", "\x1b[0m." + Colours["class"])
-                elif t == "class" and el.startswith(Colours["class"] + "class"):
-                    el = Colours["keyword1"] + "class " + Colours["class"] + el.split(" ", 1)[-1]
-                elif t in ["decorator", "regex"]:
-                    el = v
-
-                    if t == "regex":
-                        el = sub(r"\[(?:\^)?|\]", lambda m: Colours["regex2"] + m.group(0) + Colours["regex"], el)
-                        el = sub(r"\\[\\~!@#$%\^&*()_+`1234567890-={}|\[\]:\";'?,./CEFGHIJKLMNOPQRTUVXYacefghijklmnopqrtuvxyz]|[*+]", lambda m: Colours["escape"] + m.group(0) + Colours["regex"], el).replace("|", "\x1b[0m|" + Colours["regex"])
-                        el = sub(r"\(\?(?:\(\w+\)|\<\=|\<\!|\=|\!)", lambda m: f"\x1b[0m{m.group(0)}" + Colours["regex"], el)
-                        el = sub(r"\?P\=\w+|\?P\<\w+\>|\(\?[aiLmsux]{1,7}(?:\-[imsx]{1,4})?\)", lambda m: Colours["keyword1"] + m.group(0) + Colours["regex"], el)
-
-                    el = Colours["keyword1"] + (el[:2] if el[1] in 'bfr' else el[0]) + Colours[t] + el.lstrip('bfr@') + "\x1b[0m"
-                elif t == "plain":
-                    el = f"\x1b[0m{v}"
-
-                el = el.replace("\n", "\n" + Colours[t])
-            else:
-                el = "\n"
+            if i == -1: # still open at line r
+                return text.line(m.start())
 
-            text += el
+            i += len(regions[m.group()])
 
-        while search(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", text):
-            text = sub(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", "\x1b[0m" + r"\1", text)
+        return r
 
-        text = sub(*Patterns.URL, text)
+    def lines(self, text, start: int, stop: int) -> list[Line]:
+        """
+        Returns lines start to stop, sending any dirty ones to the worker,
+        and painting them meanwhile in their last known colours.
+        """
 
-        return text.removesuffix("\n")
+        stop = min(stop, text.lines)
+        e = min(text.lines, stop + self.lookahead)
 
-    def svg(self, text: str) -> str:
-        return self.html(text)
+        with self.lock:
+            del self.rows[text.lines:], self.clean[text.lines:], self.stale[text.lines:]
 
-    def txt(self, text: str) -> str:
-        text = sub(r"(?m)^\n(?=\n*(?P<level>(?:    )+))", lambda m: m.group("level") + "\n", text.replace("\t", "    ")) + "\n"
+            self.grow(e)
 
-        while search(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", text):
-            text = sub(r"\x1b\[0m([^\x1b]*)(?:\x1b\[0m)+", "\x1b[0m" + r"\1", text)
+            rows = self.rows[start:stop]
+            stale = self.stale[start:stop]
 
-        text = sub(*Patterns.URL, text)
+            if None in rows and self.job != (start, stop, self.generation): # not already being lexed
+                self.job = (start, stop, self.generation)
+                self.started += 1
+                self.worker = Thread(target=self.run, args=(text.copy(), start, stop, self.generation, self.started), daemon=True)
+                self.worker.start()
 
-        return text.removesuffix("\n")
+        if None in rows:
+            plain = text[text.linestart(start):text.lineend(stop - 1)].split("\n")
+            rows = [row or (plain[i], stale[i] or []) for i, row in enumerate(rows)]
 
-    def xml(self, text: str) -> str:
-        return self.html(text)
+        return rows # type: ignore
 
-def escapeansi(text: str) -> str:
-    return sub(r"[\x1b\x9b][\[\]]?[\=\?]?(?:[0-9]+(?:\;[0-9]+)*)?[a-zA-Z]", "", text)
+    def run(self, text, start: int, stop: int, generation: int, worker: int) -> None:
+        e = min(text.lines, stop + self.lookahead) # end of the lines lexed for context
+        retries = 0 # passes in a row that ran out of time
 
-def indexansi(text: str, start: int, stop: Optional[int]=None, step: Optional[int]=1) -> str:
-    res = ""
-    i = 0
-    x = 0
+        while True:
+            with self.lock:
+                if worker != self.started or generation != self.generation: # scrolled or edited since
+                    return
 
-    lim = (stop or len(text))
+                self.grow(e) # another job may have cut the lines short
 
-    if lim < 0:
-        lim = min(len(text) + lim, len(text))
-    else:
-        lim = min(lim, len(text))
+                if None not in self.rows[start:stop]:
+                    return
 
-    while x < len(text):
-        c = text[x]
+                y = self.rows.index(None, start, stop) # first dirty line
+                r = y # line to resume lexing from
 
-        e = match(r"[\x1b\x9b][\[\]]?[\=\?]?(?:[0-9]+(?:\;[0-9]+)*)?[a-zA-Z]", text[x:])
+                while r > 0 and not self.clean[r] and y - r < self.lookback:
+                    r -= 1
 
-        if e:
-            x += len(e.group(0))
-            res += e.group(0)
+                guessed = r > 0 and not self.clean[r]
 
-            continue
-        else:
-            x += 1
+            if guessed and self.lang in Patterns.REGIONS: # too far back to look, so start from where the region r is in opened
+                r, guessed = self.opening(text, r), False
 
+            rows, clean, done = self.lex(self.window(text, r, e), retries)
 
-        if (i + start) % (step or 1) == 0 and start <= i and i < lim:
-            res += c
+            if guessed: # lexed from a guess, so no state is known
+                clean = [None] * len(clean) # type: ignore
 
-        i += 1
+            keep = e - r if e == text.lines else e - r - self.lookahead
 
-    return res
+            with self.lock:
+                if worker != self.started or generation != self.generation:
+                    return
 
-def insertansi(text: list[str], pos: int, t: str, a: Optional[bool]=False) -> list[str]:
-    res = []
-    i = 0
+                self.grow(e)
+
+                if r + done <= y: # out of time before the first dirty line, so paint what there is and try again with more
+                    for i in range(keep):
+                        if self.rows[r + i] is None:
+                            self.stale[r + i] = rows[i][1]
+
+                    retries += 1
+
+                    continue
+
+                retries = 0
+                keep = min(keep, done) # lines lexed out of time are left dirty
+
+                for i in range(keep):
+                    if r + i > y and self.rows[r + i] is not None and self.clean[r + i] and clean[i]: # state has converged
+                        break
+
+                    self.rows[r + i] = rows[i]
+                    self.clean[r + i] = clean[i]
+
+                else: # lines past here may have been lexed from a different state
+                    del self.rows[r + keep:], self.clean[r + keep:], self.stale[r + keep:]
+
+def mark(text: str, style: Optional[str], rules: list[tuple[str, Union[Optional[str], Callable[[str], list[Piece]]]]]) -> list[Piece]:
+    """
+    Splits text into pieces of style, with the matches of each rule styled by it.
+    """
+
+    pieces: list[Piece] = []
     x = 0
 
-    while x < len(text):
-        c = text[x]
+    for m in finditer("|".join(f"(?P<r{i}>{p})" for i, (p, _) in enumerate(rules)), text):
+        s = rules[int(m.lastgroup[1:])][1] # type: ignore
+
+        pieces.append((style, text[x:m.start()]))
+        pieces += s(m.group()) if callable(s) else [(s, m.group())]
 
-        e = match(r"[\x1b\x9b][\[\]]?[\=\?]?(?:[0-9]+(?:\;[0-9]+)*)?[a-zA-Z]", "".join(text[x:]))
+        x = m.end()
 
-        if e:
-            x += len(e.group(0))
-            res += list(e.group(0))
+    pieces.append((style, text[x:]))
+
+    return pieces
+
+def overlay(spans: list[Span], start: int, stop: int, style: str) -> list[Span]:
+    """
+    Adds style to columns start to stop, splitting the spans they cross.
+    """
+
+    res = []
+    x = start # first column not yet covered
+
+    for t, a, b in spans:
+        if b <= start or a >= stop:
+            res.append((t, a, b))
 
             continue
 
-        x += 1
+        if a < start:
+            res.append((t, a, start))
+
+        if x < a:
+            res.append((style, x, a))
+
+        res.append((f"{t} {style}", max(a, start), min(b, stop)))
+        x = min(b, stop)
 
-        if i == pos - int(bool(a)):
-            res += list(t)
+        if b > stop:
+            res.append((t, stop, b))
 
-        res += [c]
+    if x < stop:
+        res.append((style, x, stop))
 
-        i += 1
+    return sorted(res, key=lambda s: s[1])
 
-    return res
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""
+This is EditPy's Undo History.
+
+© 2023 Antithesise
+"""
+
+from collections import deque
+
+from typing import Optional
+
+
+Delta = list # [start, removed, inserted], where removed was replaced by inserted at start
+
+OVERHEAD = 100 # rough bytes a delta takes beside its text
+
+
+class History:
+    """
+    Undo and redo stacks of steps, each a list of deltas rather than a copy
+    of the text. Typing merges into one step, and the oldest steps are
+    dropped once the history outgrows budget bytes. A step too big for the
+    budget on its own is dropped whole, never kept in part.
+    """
+
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+
+        self.undos: deque[list[Delta]] = deque()
+        self.redos: list[list[Delta]] = []
+        self.size = 0 # rough bytes held
+
+        self.sealed = True # the next delta starts a new step
+        self.typing = False # the last step is typing, so only typing joins it
+        self.dropped = False # the open step outgrew the budget, so it cannot be undone
+
+    def cost(self, step: list[Delta]) -> int:
+        return sum(len(d[1]) + len(d[2]) + OVERHEAD for d in step)
+
+    def record(self, start: int, removed: str, inserted: str) -> None:
+        self.size -= sum(map(self.cost, self.redos))
+        self.redos.clear()
+
+        if self.sealed:
+            self.dropped = False
+        elif self.dropped: # the rest of a step already dropped
+            return
+
+        typing = len(inserted) == 1 and inserted != "\n"
+
+        if self.sealed or not self.undos:
+            self.undos.append([[start, removed, inserted]])
+            self.typing = typing
+
+        elif self.typing and typing and not removed and start == self.undos[-1][-1][0] + len(self.undos[-1][-1][2]): # typing on
+            self.undos[-1][-1][2] += inserted
+            self.size -= OVERHEAD # counted below, but no new delta
+
+        else: # part of one command
+            self.undos[-1].append([start, removed, inserted])
+            self.typing = False
+
+        self.sealed = False
+        self.size += len(removed) + len(inserted) + OVERHEAD
+
+        while self.size > self.budget and len(self.undos) > 1: # oldest first, but never the open step
+            self.size -= self.cost(self.undos.popleft())
+
+        if self.size > self.budget: # the open step alone is too big
+            self.size -= self.cost(self.undos.pop())
+            self.dropped = True
+
+    def seal(self) -> None:
+        """
+        Ends the current step.
+        """
+
+        self.sealed = True
+
+    def undo(self) -> Optional[list[Delta]]:
+        """
+        Returns the last step to revert, if any.
+        """
+
+        self.sealed = True
+
+        if not self.undos:
+            return None
+
+        self.redos.append(self.undos.pop())
+
+        return self.redos[-1]
+
+    def redo(self) -> Optional[list[Delta]]:
+        """
+        Returns the last step reverted to apply again, if any.
+        """
+
+        self.sealed = True
+
+        if not self.redos:
+            return None
+
+        self.undos.append(self.redos.pop())
+
+        return self.undos[-1]
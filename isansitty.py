@@ -1,29 +1,88 @@
 from sys import stdin, stdout
 from platform import system
+from time import monotonic, sleep
+from contextlib import contextmanager, nullcontext
+
+from typing import ContextManager
 
 
 if system() == "Windows":
     from msvcrt import getch, kbhit # type: ignore
 
+    def raw() -> ContextManager:
+        return nullcontext()
+
+    def ready(timeout: float) -> bool:
+        """
+        Waits up to timeout seconds for input, polling between short sleeps,
+        as msvcrt has no way to wait.
+        """
+
+        deadline = monotonic() + timeout
+
+        while not kbhit():
+            if monotonic() >= deadline:
+                return False
+
+            sleep(0.005)
+
+        return True
+
 else:
     from termios import TCSADRAIN, tcgetattr, tcsetattr # type: ignore
     from select import select # type: ignore
     from tty import setraw # type: ignore
-    from sys import stdin # type: ignore
+    from os import read # type: ignore
+
+    @contextmanager # type: ignore
+    def raw():
+        """
+        Puts stdin in raw mode, so that replies can be read without a newline.
+        """
 
-    def getch() -> bytes:
         fd = stdin.fileno()
         old_settings = tcgetattr(fd)
 
         try:
             setraw(fd)
 
-            return stdin.read(1).encode()
+            yield
         finally:
             tcsetattr(fd, TCSADRAIN, old_settings)
 
+    def getch() -> bytes:
+        return read(stdin.fileno(), 1)
+
     def kbhit() -> bool:
-        return bool(select([stdin], [], [], 0)[0])
+        return ready(0)
+
+    def ready(timeout: float) -> bool:
+        """
+        Waits up to timeout seconds for input.
+        """
+
+        return bool(select([stdin], [], [], timeout)[0])
+
+
+def query(sequence: str, end: bytes) -> bytes:
+    """
+    Writes sequence and returns the terminal's reply, read up to end.
+    """
+
+    with raw():
+        while kbhit():
+            getch()
+
+        stdout.write(sequence)
+        stdout.flush()
+
+        reply = b""
+        deadline = monotonic() + 0.1
+
+        while not reply.endswith(end) and (remaining := deadline - monotonic()) > 0 and ready(remaining):
+            reply += getch()
+
+    return reply
 
 
 def isansitty() -> bool:
@@ -31,19 +90,14 @@ def isansitty() -> bool:
     Checks if stdout supports ANSI escape codes and is a tty.
     """
 
-    while kbhit():
-        getch()
+    return query("\x1b[6n", b"R").startswith(b"\x1b[") and stdout.isatty()
 
-    stdout.write("\x1b[6n")
-    stdout.flush()
 
-    stdin.flush()
-    if kbhit():
-        if ord(getch()) == 27 and kbhit():
-            if getch() == b"[":
-                while kbhit():
-                    getch()
+def issynchronised() -> bool:
+    """
+    Checks if the terminal supports synchronised updates (mode 2026).
+    """
 
-                return stdout.isatty()
+    reply = query("\x1b[?2026$p", b"y")
 
-    return False
\ No newline at end of file
+    return reply.startswith(b"\x1b[?2026;") and reply[8:9] in [b"1", b"2"]
@@ -0,0 +1,186 @@
+"""
+This is EditPy's Edit Journal.
+
+© 2023 Antithesise
+"""
+
+from os import fsync, remove, stat
+from os.path import basename, dirname, join
+from struct import Struct
+from threading import Event, Lock, RLock, Thread
+from time import sleep
+
+
+HEADER = Struct("<4sQQ") # magic, then size and modification time of the file the edits apply to
+RECORD = Struct("<QQI") # start, stop and length of the text replacing them
+MAGIC = b"EPJ1"
+
+
+class Journal:
+    """
+    An append-only log of the edits made to a file since it was last saved,
+    kept beside it so unsaved work survives a crash. Edits are written in
+    batches by a worker thread, and typing merges into one record.
+    """
+
+    delay = 0.5 # seconds edits are gathered before being written
+
+    def __init__(self, path: str) -> None:
+        self.file = path
+        self.path = join(dirname(path), f".{basename(path)}.journal")
+
+        self.base = self.identify() # the file as the edits found it
+        self.edits: list[list] = [] # edits since base, as [start, stop, text]
+        self.flushed = 0 # edits written
+        self.sealed = 0 # edits before this were saved, so are never merged into
+        self.started = False # journal written by this session
+
+        self.lock = Lock() # guards edits
+        self.writing = RLock() # guards the journal file
+        self.wake = Event()
+        self.closed = False
+
+        Thread(target=self.run, daemon=True).start()
+
+    def identify(self) -> tuple[int, int]:
+        try:
+            s = stat(self.file)
+        except OSError:
+            return 0, 0
+
+        return s.st_size, s.st_mtime_ns
+
+    def restore(self) -> list[tuple[int, int, str]]:
+        """
+        Returns the edits left by a session that did not exit cleanly, if
+        they still apply to the file, and carries on journaling after them.
+        """
+
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return []
+
+        if len(data) < HEADER.size or HEADER.unpack_from(data) != (MAGIC, *self.base): # the file changed since
+            try:
+                remove(self.path)
+            except OSError:
+                pass
+
+            return []
+
+        edits = []
+        i = HEADER.size
+
+        while i + RECORD.size <= len(data):
+            start, stop, n = RECORD.unpack_from(data, i)
+            i += RECORD.size
+
+            if i + n > len(data): # cut off by the crash
+                break
+
+            edits.append((start, stop, data[i:i + n].decode("utf-8")))
+            i += n
+
+        self.edits = [list(e) for e in edits]
+        self.flushed = self.sealed = len(edits)
+        self.started = True
+
+        return edits
+
+    def record(self, start: int, stop: int, text: str) -> None:
+        with self.lock:
+            last = self.edits[-1] if len(self.edits) > max(self.flushed, self.sealed) else None
+
+            if last is not None and start == stop == last[0] + len(last[2]): # typing on
+                last[2] += text
+            else:
+                self.edits.append([start, stop, text])
+
+        self.wake.set()
+
+    def mark(self) -> int:
+        """
+        Returns how many edits a save taken now includes.
+        """
+
+        with self.lock:
+            self.sealed = len(self.edits)
+
+            return self.sealed
+
+    def rebase(self, mark: int) -> None:
+        """
+        Drops the edits before mark, now that they are saved, and rewrites
+        the journal for the file as saved.
+        """
+
+        with self.writing:
+            with self.lock:
+                del self.edits[:mark]
+
+                self.flushed = 0
+                self.sealed = max(0, self.sealed - mark)
+                self.started = False
+                self.base = self.identify()
+
+            if self.edits:
+                self.flush()
+            else:
+                self.delete()
+
+    def flush(self) -> None:
+        with self.writing:
+            if self.closed:
+                return
+
+            with self.lock:
+                batch = [(s, e, t.encode("utf-8")) for s, e, t in self.edits[self.flushed:]]
+                self.flushed = len(self.edits)
+
+            if not batch:
+                return
+
+            try:
+                with open(self.path, "ab" if self.started else "wb") as f:
+                    if not self.started:
+                        f.write(HEADER.pack(MAGIC, *self.base))
+
+                    f.write(b"".join(RECORD.pack(s, e, len(t)) + t for s, e, t in batch))
+                    f.flush()
+                    fsync(f.fileno())
+
+                self.started = True
+            except OSError: # journaling is best effort
+                pass
+
+    def delete(self) -> None:
+        try:
+            remove(self.path)
+        except OSError:
+            pass
+
+    def run(self) -> None:
+        while not self.closed:
+            self.wake.wait()
+            self.wake.clear()
+
+            sleep(self.delay) # gather a batch
+
+            self.flush()
+
+    def close(self, keep: bool=False) -> None:
+        """
+        Stops journaling, writing what is left if keep, else deleting the journal.
+        """
+
+        with self.writing:
+            if keep:
+                self.flush()
+            else:
+                self.delete()
+
+            self.closed = True
+
+        self.wake.set()
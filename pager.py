@@ -0,0 +1,177 @@
+"""
+This is EditPy's File Pager.
+
+© 2023 Antithesise
+"""
+
+from array import array
+from bisect import bisect_left
+from codecs import getincrementaldecoder
+from mmap import ACCESS_READ, mmap
+
+from typing import Iterator, Optional, Union, overload
+
+
+WINDOW = 1 << 16 # bytes scanned at a time
+MARKS = 1 << 16 # most marks kept in the line index
+SLICE = 1 << 24 # bytes indexed between yields
+
+
+class Pager:
+    """
+    A read-only view of a file too big to load, mapped into memory. Offsets
+    are in bytes, and lines are found through a sparse index of how many
+    line breaks come before every stride bytes, which halves in density
+    whenever it fills, so it never outgrows MARKS entries.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "rb")
+
+        try:
+            self.map: Union[mmap, bytes] = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+        except ValueError: # empty files cannot be mapped
+            self.map = b""
+
+        self.stride = WINDOW # bytes between marks
+        self.marks = array("Q", [0]) # line breaks before each mark
+        self.end = 0 # bytes indexed
+        self.breaks = 0 # line breaks before end
+
+        self.near = (0, 0) # line and offset last found, as consecutive lookups are close
+
+    def __len__(self) -> int:
+        return len(self.map)
+
+    def __repr__(self) -> str:
+        return f"Pager({len(self)} bytes)"
+
+    @overload
+    def __getitem__(self, key: int) -> str: pass
+
+    @overload
+    def __getitem__(self, key: slice) -> str: pass
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            key = slice(key, key + 1 or None)
+
+        return self.map[key].decode("utf-8", "replace").replace("\r", " ") # a carriage return would move the cursor
+
+    @property
+    def lines(self) -> int:
+        return self.breaks + 1 # those indexed so far
+
+    def index(self) -> Iterator[float]:
+        """
+        Builds the line index, yielding the fraction done every SLICE bytes.
+        """
+
+        while self.end < len(self):
+            stop = min(len(self), len(self.marks) * self.stride)
+
+            self.breaks += self.count(self.end, stop)
+            self.end = stop
+
+            if stop < len(self):
+                self.marks.append(self.breaks)
+
+                if len(self.marks) == MARKS:
+                    self.marks = self.marks[::2]
+                    self.stride *= 2
+
+            if self.end % SLICE < self.stride:
+                yield self.end / len(self)
+
+    def count(self, start: int, stop: int) -> int:
+        """
+        Returns the line breaks between start and stop, reading rather than
+        touching the map, so scanned pages are not kept resident.
+        """
+
+        self.file.seek(start)
+
+        return sum(self.file.read(min(stop - i, WINDOW)).count(b"\n") for i in range(start, stop, WINDOW))
+
+    def seek(self, y: int) -> int:
+        """
+        Returns the offset after line break y, or -1 if there are fewer.
+        """
+
+        k = bisect_left(self.marks, y) - 1 # last mark before the line break
+        p, n = k * self.stride, y - self.marks[k]
+
+        if p <= self.near[1] and self.near[0] <= y:
+            p, n = self.near[1], y - self.near[0]
+
+        while p < len(self):
+            window = self.map[p:p + WINDOW]
+            c = window.count(b"\n")
+
+            if c >= n:
+                p += len(window) - len(window.split(b"\n", n)[-1])
+                self.near = (y, p)
+
+                return p
+
+            n -= c
+            p += len(window)
+
+        return -1
+
+    def line(self, i: int) -> int:
+        """
+        Returns the line containing offset i.
+        """
+
+        i = max(0, min(i, len(self)))
+        k = min(i // self.stride, len(self.marks) - 1)
+
+        return self.marks[k] + self.count(k * self.stride, i)
+
+    def linestart(self, y: int) -> int:
+        """
+        Returns the offset of the first byte of line y.
+        """
+
+        if y <= 0:
+            return 0
+
+        p = self.seek(y)
+
+        return len(self) if p == -1 else p
+
+    def lineend(self, y: int) -> int:
+        """
+        Returns the offset of the line break ending line y.
+        """
+
+        p = self.seek(y + 1)
+
+        return len(self) if p == -1 else p - 1
+
+    def position(self, i: int) -> tuple[int, int]:
+        y = self.line(i)
+
+        return self.column(self.linestart(y), i), y
+
+    def column(self, start: int, i: int) -> int:
+        """
+        Returns the column of offset i on the line starting at offset start,
+        counting characters as shown rather than bytes.
+        """
+
+        return len(self[start:i])
+
+    def chunks(self, start: int=0, stop: Optional[int]=None) -> Iterator[str]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        decoder = getincrementaldecoder("utf-8")("replace")
+
+        for i in range(max(0, start), stop, WINDOW):
+            yield decoder.decode(self.map[i:min(stop, i + WINDOW)], i + WINDOW >= stop)
+
+    def close(self) -> None:
+        if isinstance(self.map, mmap):
+            self.map.close()
+
+        self.file.close()
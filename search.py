@@ -0,0 +1,279 @@
+"""
+This is EditPy's Search Engine.
+
+© 2023 Antithesise
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from re import Match, Pattern, compile
+from threading import Lock, Thread
+
+from typing import Callable, Iterator, Optional, Union
+
+from buffer import Buffer
+from pager import Pager
+
+
+WINDOW = 1 << 16 # characters searched at a time
+CONTEXT = 1 << 10 # characters kept before a window, for matches that look behind or straddle it
+
+
+@lru_cache(maxsize=64)
+def pattern(regex: str) -> Pattern:
+    """
+    Compiles regex, remembering the most recently used.
+    """
+
+    return compile(regex)
+
+def search(text: Union[Buffer, Pager], regex: Pattern, start: int=0, stop: Optional[int]=None, cancelled: Callable[[], bool]=lambda: False) -> Iterator[tuple[int, int, Match]]:
+    """
+    Finds the matches of regex in text[start:stop] a window at a time,
+    yielding their spans and matches. A match running into the end of a
+    window is searched again in one twice the size. The pager's offsets
+    are in bytes, so its windows are decoded keeping each byte that is not
+    UTF-8 as one character, and the spans are counted back in bytes.
+    Stops early once cancelled returns true, checked every window.
+    """
+
+    stop = len(text) if stop is None else min(stop, len(text))
+    pos = start
+    size = WINDOW
+
+    while not cancelled():
+        base = max(0, pos - CONTEXT) # so anchors and lookbehinds see what comes before
+        end = min(stop, pos + size)
+
+        if isinstance(text, Pager):
+            for _ in range(3): # the window starts and ends between characters, as byte offsets can fall within them
+                if pos < end and text.map[pos] & 0xC0 == 0x80:
+                    pos += 1
+
+                if pos < end < stop and text.map[end] & 0xC0 == 0x80:
+                    end -= 1
+
+        cut = end if end == stop else end - CONTEXT # matches starting past here are left to the next window
+
+        window = text.map[base:end].decode("utf-8", "surrogateescape") if isinstance(text, Pager) else text[base:end]
+        offset = None if window.isascii() or not isinstance(text, Pager) else Offsets(window, base) # otherwise a character to a byte
+        first = pos - base if offset is None else len(text.map[base:pos].decode("utf-8", "surrogateescape"))
+
+        last = pos
+        grow = False
+
+        for m in regex.finditer(window, first):
+            a, b = (base + m.start(), base + m.end()) if offset is None else (offset(m.start()), offset(m.end()))
+
+            if a >= cut and end < stop:
+                break
+
+            if b == end and end < stop: # could run on past the window
+                grow = True
+
+                break
+
+            yield a, b, m
+
+            last = b if a < b else b + len(window[m.end():m.end() + 1].encode("utf-8", "surrogateescape")) # steps past an empty match, a whole character
+
+        if grow:
+            pos = last
+            size *= 2
+
+        elif end == stop:
+            return
+
+        else:
+            pos = max(last, cut)
+            size = WINDOW
+
+
+class Offsets:
+    """
+    Converts character offsets into a window of the pager to byte offsets,
+    counting on from the last, so each byte is counted once as long as the
+    offsets asked for never go back.
+    """
+
+    def __init__(self, window: str, base: int) -> None:
+        self.window = window
+        self.i = 0 # last character offset
+        self.p = base # and its byte offset
+
+    def __call__(self, i: int) -> int:
+        self.p += len(self.window[self.i:i].encode("utf-8", "surrogateescape"))
+        self.i = i
+
+        return self.p
+
+class Index:
+    """
+    The spans of a pattern's matches in a text, found by a worker thread
+    and kept sorted in blocks, so the next or previous match is found by
+    bisection. Until the worker is done, matches are searched for directly.
+    Edits are patched in by searching again only around them.
+    """
+
+    block = 1024 # most matches in a block
+
+    def __init__(self, text: Union[Buffer, Pager], regex: Pattern) -> None:
+        self.text = text
+        self.regex = regex
+
+        self.blocks: list[list] = [] # [shift, starts, stops], the shift added to each
+        self.done = False # blocks hold every match
+        self.generation = 0 # bumped to cancel the worker
+        self.lock = Lock() # so a cancelled worker cannot publish
+
+        self.start()
+
+    def __len__(self) -> int:
+        return sum(len(b[1]) for b in self.blocks)
+
+    def start(self) -> None:
+        """
+        Indexes a snapshot of the text on a new worker, cancelling the last.
+        """
+
+        with self.lock:
+            self.generation += 1
+            self.done = False
+
+        text = self.text.copy() if isinstance(self.text, Buffer) else self.text # the rope is persistent, so copies are free
+
+        Thread(target=self.run, args=(text, self.generation), daemon=True).start()
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.generation += 1
+
+    def run(self, text: Union[Buffer, Pager], generation: int) -> None:
+        blocks: list[list] = []
+
+        for start, stop, _ in search(text, self.regex, cancelled=lambda: generation != self.generation):
+            if not blocks or len(blocks[-1][1]) == self.block:
+                blocks.append([0, array("q"), array("q")])
+
+            blocks[-1][1].append(start)
+            blocks[-1][2].append(stop)
+
+        with self.lock:
+            if generation == self.generation: # or it was cancelled, and blocks may be cut short
+                self.blocks = blocks
+                self.done = True
+
+    def within(self, start: int, stop: int) -> list[tuple[int, int]]:
+        """
+        Returns the spans of the matches overlapping start to stop.
+        """
+
+        if not self.done:
+            return [(a, b) for a, b, _ in search(self.text, self.regex, max(0, start - CONTEXT), stop + CONTEXT) if b > start and a < stop]
+
+        res = []
+        k = max(0, bisect_right(self.blocks, start, key=lambda b: b[0] + b[1][0]) - 1)
+
+        for shift, starts, stops in self.blocks[k:]:
+            for i in range(bisect_right(stops, start - shift), len(starts)):
+                if starts[i] + shift >= stop:
+                    return res
+
+                res.append((starts[i] + shift, stops[i] + shift))
+
+        return res
+
+    def next(self, i: int) -> Optional[tuple[int, int]]:
+        """
+        Returns the span of the first match starting after i, wrapping round.
+        """
+
+        if not self.done:
+            found = next(search(self.text, self.regex, i + 1), None) or next(search(self.text, self.regex, 0, i + 1), None)
+
+            return found and found[:2]
+
+        if not self.blocks:
+            return None
+
+        k = max(0, bisect_right(self.blocks, i, key=lambda b: b[0] + b[1][0]) - 1)
+
+        for shift, starts, stops in self.blocks[k:k + 2]:
+            j = bisect_right(starts, i - shift)
+
+            if j < len(starts):
+                return starts[j] + shift, stops[j] + shift
+
+        shift, starts, stops = self.blocks[0]
+
+        return starts[0] + shift, stops[0] + shift
+
+    def previous(self, i: int) -> Optional[tuple[int, int]]:
+        """
+        Returns the span of the last match starting before i, wrapping round.
+        """
+
+        if not self.done:
+            found = None
+            a = i
+
+            while found is None and a > 0: # windows of growing size back from i
+                a = max(0, i - (i - a) * 2 - WINDOW)
+                found = next(reversed(list(search(self.text, self.regex, a, i))), None)
+
+            found = found or next(reversed(list(search(self.text, self.regex, i))), None)
+
+            return found and found[:2]
+
+        if not self.blocks:
+            return None
+
+        k = bisect_left(self.blocks, i, key=lambda b: b[0] + b[1][0]) - 1
+        shift, starts, stops = self.blocks[k] # the last block if none start before i
+        j = bisect_left(starts, i - shift) - 1 if k >= 0 else len(starts) - 1
+
+        return starts[j] + shift, stops[j] + shift
+
+    def edit(self, start: int, stop: int, length: int) -> None:
+        """
+        Patches in text[start:stop] having been replaced by length characters.
+        """
+
+        if not self.done:
+            self.start()
+
+            return
+
+        delta = length - (stop - start)
+        a, b = max(0, start - CONTEXT), stop + CONTEXT # matches near the edit are searched again
+
+        k1 = bisect_left(self.blocks, a, key=lambda b: b[0] + b[2][-1])
+        k2 = bisect_right(self.blocks, b, key=lambda b: b[0] + b[1][0])
+
+        near = [(s + shift, e + shift) for shift, starts, stops in self.blocks[k1:k2] for s, e in zip(starts, stops) if e + shift >= a and s + shift <= b]
+
+        if near: # widened to the matches it cuts, so they are searched again whole
+            a, b = min(a, near[0][0]), max(b, near[-1][1])
+
+        k1 = bisect_left(self.blocks, a, key=lambda b: b[0] + b[1][-1]) # the blocks of the matches starting from a to b
+        k2 = bisect_right(self.blocks, b, key=lambda b: b[0] + b[1][0])
+
+        spans = [(s + shift, e + shift) for shift, starts, stops in self.blocks[k1:k2] for s, e in zip(starts, stops)]
+        before = [(s, e) for s, e in spans if s < a]
+        after = [(s + delta, e + delta) for s, e in spans if s > b]
+        found = []
+
+        for s, e, _ in search(self.text, self.regex, a): # not cut off at b, which would end the text there
+            if s > b + delta:
+                break
+
+            found.append((s, e))
+
+        spans = before + found + after
+        blocks = [[0, array("q", [s for s, _ in spans[i:i + self.block]]), array("q", [e for _, e in spans[i:i + self.block]])] for i in range(0, len(spans), self.block)]
+
+        for block in self.blocks[k2:]:
+            block[0] += delta
+
+        self.blocks[k1:k2] = blocks
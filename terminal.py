@@ -0,0 +1,217 @@
+"""
+This is EditPy's Terminal Input.
+
+© 2023 Antithesise
+"""
+
+from platform import system
+from time import monotonic
+
+from typing import Literal, Optional, Union
+
+
+if system() == "Windows":
+    from ctypes import Structure, byref, c_byte, c_int, c_ulong, c_ushort, windll # type: ignore
+    from msvcrt import getch, kbhit # type: ignore
+
+    class InputRecord(Structure):
+        _fields_ = [("EventType", c_ushort), ("KeyDown", c_int), ("Event", c_byte * 12)]
+
+    kernel32 = windll.kernel32
+
+    class Terminal:
+        """
+        The console's keyboard, read as (key, code) events, where code is the
+        scan code of an extended key (key 0).
+        """
+
+        def __init__(self) -> None:
+            self.handle = kernel32.GetStdHandle(-10) # console input
+            self.mode = c_ulong() # console mode before start
+
+        def start(self) -> None:
+            if kernel32.GetConsoleMode(self.handle, byref(self.mode)):
+                kernel32.SetConsoleMode(self.handle, self.mode.value | 0x0008) # report resizes
+
+        def stop(self) -> None:
+            kernel32.SetConsoleMode(self.handle, self.mode.value)
+
+        def wait(self, timeout: Optional[float]=None) -> Optional[Literal["key", "resize"]]:
+            """
+            Sleeps until a key is pressed, the console is resized or timeout seconds pass.
+            """
+
+            end = None if timeout is None else monotonic() + timeout
+            record = InputRecord()
+            n = c_ulong()
+
+            while True:
+                if kbhit():
+                    return "key"
+
+                ms = 0xFFFFFFFF if end is None else max(0, round((end - monotonic()) * 1000))
+
+                if kernel32.WaitForSingleObject(self.handle, ms) != 0: # timed out
+                    return None
+
+                kernel32.PeekConsoleInputW(self.handle, byref(record), 1, byref(n))
+
+                if n.value and not kbhit(): # not a keystroke, so it would wake us forever
+                    kernel32.ReadConsoleInputW(self.handle, byref(record), 1, byref(n))
+
+                    if record.EventType == 4: # window buffer size
+                        return "resize"
+
+        def getkey(self) -> tuple[int, Union[int, str]]:
+            key = ord(getch())
+
+            if key in [0, 224]:
+                return 0, ord(getch())
+
+            return key, 0
+
+else:
+    from os import pipe, read, set_blocking, write # type: ignore
+    from re import compile # type: ignore
+    from select import select # type: ignore
+    from signal import SIG_DFL, SIGWINCH, signal # type: ignore
+    from sys import stdin # type: ignore
+    from termios import TCSADRAIN, tcgetattr, tcsetattr # type: ignore
+    from tty import setraw # type: ignore
+
+    KEYS = { # escape sequences of the extended keys, as scan codes
+        b"\x1b[A": 72, b"\x1bOA": 72, # up
+        b"\x1b[D": 75, b"\x1bOD": 75, # left
+        b"\x1b[C": 77, b"\x1bOC": 77, # right
+        b"\x1b[B": 80, b"\x1bOB": 80, # down
+        b"\x1b[3~": 83, # delete
+        b"\x1b[1;5D": 115, b"\x1b[5D": 115, # ctrl+left
+        b"\x1b[1;5C": 116, b"\x1b[5C": 116 # ctrl+right
+    }
+
+    SEQUENCE = compile(rb"\x1b(?:\[[0-?]*[ -/]*[@-~]|O[@-~])") # a whole escape sequence
+    PARTIAL = compile(rb"\x1b(?:\[[0-?]*[ -/]*|O)?$") # the start of one
+
+    class Terminal:
+        """
+        The terminal's keyboard, read as (key, code) events like msvcrt's, where
+        code is the scan code of an extended key (key 0). A bracketed paste is
+        read as ctrl+v (key 22), with the text pasted as code.
+        """
+
+        def __init__(self) -> None:
+            self.fd = stdin.fileno()
+            self.attributes: Optional[list] = None # terminal attributes before start
+            self.pending = b"" # bytes read but not yet decoded
+
+            self.resized, self.wake = pipe() # written to on SIGWINCH, so select wakes
+
+            set_blocking(self.resized, False)
+            set_blocking(self.wake, False)
+
+        def start(self) -> None:
+            """
+            Enters raw mode for the whole session, keeping output processing.
+            """
+
+            self.attributes = tcgetattr(self.fd)
+
+            setraw(self.fd, TCSADRAIN)
+
+            mode = tcgetattr(self.fd)
+            mode[1] = self.attributes[1] # output flags
+
+            tcsetattr(self.fd, TCSADRAIN, mode)
+
+            signal(SIGWINCH, lambda *_: write(self.wake, b"\0"))
+
+        def stop(self) -> None:
+            signal(SIGWINCH, SIG_DFL)
+
+            if self.attributes is not None:
+                tcsetattr(self.fd, TCSADRAIN, self.attributes)
+
+        def wait(self, timeout: Optional[float]=None) -> Optional[Literal["key", "resize"]]:
+            """
+            Sleeps until a key is pressed, the terminal is resized or timeout seconds pass.
+            """
+
+            if self.pending:
+                return "key"
+
+            ready = select([self.fd, self.resized], [], [], timeout)[0]
+
+            if self.resized in ready:
+                while True: # many signals make one resize
+                    try:
+                        read(self.resized, 64)
+                    except BlockingIOError:
+                        return "resize"
+
+            return "key" if ready else None
+
+        def fill(self, timeout: Optional[float]=None) -> bool:
+            """
+            Reads whatever input is waiting into pending, waiting up to timeout seconds.
+            """
+
+            if select([self.fd], [], [], timeout)[0]:
+                self.pending += read(self.fd, 4096)
+
+                return True
+
+            return False
+
+        def paste(self) -> str:
+            """
+            Reads the rest of a bracketed paste in bulk.
+            """
+
+            text = bytearray(self.pending)
+            i = 0 # where the end marker could start
+
+            while (end := text.find(b"\x1b[201~", i)) == -1:
+                i = max(0, len(text) - 5)
+                text += read(self.fd, 65536)
+
+            self.pending = bytes(text[end + 6:])
+
+            return text[:end].decode(errors="replace")
+
+        def getkey(self) -> tuple[int, Union[int, str]]:
+            while True:
+                if not self.pending:
+                    self.fill()
+
+                    continue
+
+                if self.pending[0] == 27:
+                    m = SEQUENCE.match(self.pending)
+
+                    if m is None:
+                        if PARTIAL.match(self.pending) and self.fill(0.05): # rest of the sequence is on its way
+                            continue
+
+                        self.pending = self.pending[1:] # escape key
+
+                        return 27, 0
+
+                    self.pending = self.pending[m.end():]
+
+                    if m.group() == b"\x1b[200~": # bracketed paste
+                        return 22, self.paste()
+
+                    if m.group() in KEYS:
+                        return 0, KEYS[m.group()]
+
+                    continue # a key with no meaning here
+
+                n = 1 + (self.pending[0] >= 0xC0) + (self.pending[0] >= 0xE0) + (self.pending[0] >= 0xF0) # utf-8 length
+
+                if len(self.pending) < n and self.fill(0.05):
+                    continue
+
+                c = self.pending[:n].decode(errors="replace")[0]
+                self.pending = self.pending[n:]
+
+                return (8 if c == "\x7f" else ord(c)), 0 # backspace sends delete
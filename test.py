@@ -0,0 +1,196 @@
+"""
+This is EditPy's Test Suite.
+
+© 2023 Antithesise
+"""
+
+from math import inf
+from os import remove
+from tempfile import mkstemp
+from time import perf_counter, sleep
+from unittest import TestCase, main
+
+from buffer import Buffer
+from highlight import Highlight, Highlighter, Lexers
+from history import OVERHEAD, History
+from pager import Pager
+from search import WINDOW, Index, pattern, search
+
+
+N = 20000 # characters in the smaller of each pair of adversarial inputs
+
+Adversarial = { # inputs that once made a pattern backtrack for seconds or worse
+    "css no delimiters": ("css", lambda n: "a b " * (n // 4)),
+    "css minified": ("css", lambda n: "a{color:red}" * (n // 12)),
+    "css unclosed selectors": ("css", lambda n: "a[b=c " * (n // 6)),
+    "html minified": ("html", lambda n: "<a href=x>y</a>" * (n // 15)),
+    "html prose": ("html", lambda n: "<p>" + "word " * (n // 5)),
+    "html unclosed script": ("html", lambda n: "<script>" + "x = 1; " * (n // 7)),
+    "html scripts": ("html", lambda n: "<script>x = 1;</script><p>y</p>" * (n // 31)),
+    "html unclosed styles": ("html", lambda n: "<style>x" * (n // 8)),
+    "html unclosed tags": ("html", lambda n: "<script" * (n // 7)),
+    "md long line": ("md", lambda n: "word " * (n // 5)),
+    "md unclosed bold": ("md", lambda n: "**" + "a " * (n // 2)),
+    "md brackets": ("md", lambda n: "[a " * (n // 3)),
+    "py long identifier": ("py", lambda n: "a" * n + "\n"),
+    "py dotted names": ("py", lambda n: "a.b " * (n // 4))
+}
+
+
+def timed(lang: str, text: str) -> float:
+    h = Highlight()
+    h.budget = inf # so only the patterns bound the time
+
+    best = inf
+
+    for _ in range(3): # the least is the least disturbed
+        start = perf_counter()
+        h(lang, text)
+        best = min(best, perf_counter() - start)
+
+    return best
+
+class TestHighlight(TestCase):
+    def test_linear(self) -> None:
+        for name, (lang, make) in Adversarial.items():
+            with self.subTest(name):
+                self.assertLess(timed(lang, make(4 * N)) / timed(lang, make(N)), 8) # four times the text takes about four times as long, where quadratic work takes sixteen
+
+    def test_partial(self) -> None:
+        h = Highlight()
+        h.budget = 0 # out of time at once, so all plain
+
+        self.assertEqual(h("py", "def f():\n    return 1"), [("def f():", []), ("    return 1", [])])
+
+    def test_retried(self) -> None:
+        text = Buffer("\n".join(f"def f{i}(x):\n    return '''{i}\n    ''' + x" for i in range(40)))
+        lines = {}
+
+        for budget in [inf, 1e-6]: # lines lexed out of time are lexed again, with more
+            h = Highlighter("py")
+            h.budget = budget
+
+            while None in h.rows[:60] or not h.rows:
+                h.lines(text, 0, 60)
+
+                if h.worker is not None:
+                    h.worker.join()
+
+            lines[budget] = h.lines(text, 0, 60)
+
+        self.assertEqual(lines[1e-6], lines[inf])
+
+    def test_opening(self) -> None:
+        text = Buffer('"""\n' + "x\n" * 150 + '"""\n' + 'def f(x):\n    """x\n    """\n' * 50)
+        h = Highlighter("py")
+        h.budget = inf
+
+        while None in h.rows[240:260] or not h.rows: # so the lines looked back on start within the first string
+            h.lines(text, 240, 260)
+
+            if h.worker is not None:
+                h.worker.join()
+
+        self.assertEqual(h.lines(text, 240, 260), Highlight()("py", text[0:len(text)])[240:260])
+
+    def test_tokens(self) -> None:
+        text = "@cache\ndef f(x: int) -> str:\n    if x:\n        return f'{x}' + r'\\d' # done\n    return str(X_1)\n"
+        h = Highlight()
+        h.scanners = Lexers["tokens"]
+
+        for start in [0, 3]: # from the top, and from within a block, dedenting past where it starts
+            with self.subTest(start):
+                window = "\n".join(text.split("\n")[start:])
+
+                self.assertEqual(h("py", window), Highlight()("py", window))
+
+    def test_embedded(self) -> None:
+        lines = Highlight()("html", "<style>a { color: red; }</style><script>var x;</script>")
+
+        self.assertIn(("selector", 7, 8), lines[0][1]) # lexed as css
+        self.assertIn(("js", 40, 46), lines[0][1])
+
+class TestSearch(TestCase):
+    def indexed(self, text: Buffer, regex: str) -> Index:
+        index = Index(text, pattern(regex))
+
+        while not index.done:
+            sleep(0.001)
+
+        return index
+
+    def test_edit(self) -> None:
+        text = Buffer("x" * 1024 + "abab")
+        index = self.indexed(text, "ab")
+
+        text.insert(0, "y") # the second match starts just past the text searched again before it is widened
+        index.edit(0, 0, 1)
+
+        self.assertEqual(index.within(0, len(text)), [(1025, 1027), (1027, 1029)])
+
+    def test_cancel(self) -> None:
+        text = Buffer("x" * 4 * WINDOW)
+        checks = []
+
+        self.assertEqual(list(search(text, pattern("y"), cancelled=lambda: checks.append(0) or len(checks) > 2)), []) # no matches, yet stopped
+        self.assertEqual(len(checks), 3) # once a window
+
+    def test_pager(self) -> None:
+        fd, path = mkstemp()
+
+        with open(fd, "wb") as f:
+            f.write("héllo wörld\nfoo bar\n".encode())
+
+        pager = Pager(path)
+
+        try:
+            self.assertEqual([pager[a:b] for a, b, _ in search(pager, pattern("w.rld|bar"))], ["wörld", "bar"]) # spans in bytes
+        finally:
+            pager.close()
+            remove(path)
+
+class TestHistory(TestCase):
+    def test_merge(self) -> None:
+        history = History(1 << 20)
+
+        for i, c in enumerate("abc"): # typing joins one step
+            history.record(i, "", c)
+
+        history.record(3, "", "\n") # a newline is its own delta
+        history.seal()
+        history.record(4, "", "d") # and sealing starts a new step
+
+        self.assertEqual(history.undo(), [[4, "", "d"]])
+        self.assertEqual(history.undo(), [[0, "", "abc"], [3, "", "\n"]])
+        self.assertIsNone(history.undo())
+
+    def test_evict(self) -> None:
+        history = History(3 * (OVERHEAD + 1))
+
+        for i in range(5):
+            history.record(i, "", "\n")
+            history.seal()
+
+        self.assertEqual(len(history.undos), 3) # the oldest dropped
+        self.assertEqual(history.undos[0], [[2, "", "\n"]])
+        self.assertLessEqual(history.size, history.budget)
+
+    def test_oversized(self) -> None:
+        history = History(3 * (OVERHEAD + 1))
+        history.record(0, "", "\n")
+        history.seal()
+
+        for i in range(1, 6): # one step of five deltas, too big to keep
+            history.record(i, "", "\n")
+
+        self.assertTrue(history.dropped)
+        self.assertIsNone(history.undo()) # dropped whole, not cut to its last deltas
+        self.assertEqual(history.size, 0)
+
+        history.record(0, "", "\n") # a new step is kept again
+        self.assertFalse(history.dropped)
+        self.assertEqual(history.undo(), [[0, "", "\n"]])
+
+
+if __name__ == "__main__":
+    main()